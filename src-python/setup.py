@@ -32,7 +32,8 @@ setup(name='amazon-textract-response-parser',
       description='Easily parse JSON returned by Amazon Textract.',
       install_requires=requirements,
       extras_require={
-          "dev": ["pytest", "tabulate"]
+          "dev": ["pytest", "tabulate"],
+          "numpy": ["numpy"]
       },
       scripts=['bin/amazon-textract-pipeline'],
       long_description_content_type='text/markdown',
@@ -3,7 +3,6 @@ import json
 import os
 
 # Local Dependencies:
-from trp import Document
 from trp.t_tables import __compare_table_headers, ExecuteTableValidations, HeaderFooterType
 from trp.trp2 import TDocument, TDocumentSchema
 
@@ -18,26 +17,27 @@ def test_table_header_compare():
     """
     with open(os.path.join(current_folder, "data/gib_multi_tables_multi_page_sample.json")) as f:
         j = json.load(f)
-    doc = Document(j)
+    t_document = TDocument.from_dict(j)
     # Load 2 tables with same column count:
     test_table_1_id = "4894d2ba-0479-4196-9cbd-c0fea4d28762"
-    test_table_1 = doc.pages[0].tables[0]
+    test_table_1 = t_document.tables(page=t_document.pages[0])[0]
     test_table_2_id = "b5e061ec-05be-48d5-83fc-6719fdd4397a"
-    test_table_2 = doc.pages[1].tables[1]
+    test_table_2 = t_document.tables(page=t_document.pages[1])[1]
     assert test_table_1.id == test_table_1_id
     assert test_table_2.id == test_table_2_id
 
     # compare_table_headers should return false (different text):
-    assert __compare_table_headers(test_table_1, test_table_2) is False
+    assert __compare_table_headers(t_document, test_table_1, test_table_2) is False
 
     # Overwrite the header text to match between the two tables:
-    for ix, cell in enumerate(test_table_1.rows[0].cells):
-        cell.text = f"DUMMY TEXT {ix}"
-    for ix, cell in enumerate(test_table_2.rows[0].cells):
-        cell.text = f"DUMMY TEXT {ix}"
+    for table in [test_table_1, test_table_2]:
+        for cell in t_document.get_blocks_for_relationships(table.get_relationships_for_type()):
+            if cell.row_index == 1:
+                for ix, word in enumerate(t_document.get_blocks_for_relationships(cell.get_relationships_for_type())):
+                    word.text = f"DUMMY TEXT {cell.column_index} {ix}"
 
     # compare_table_headers should return true because the text matches:
-    assert __compare_table_headers(test_table_1, test_table_2) is True
+    assert __compare_table_headers(t_document, test_table_1, test_table_2) is True
 
 
 def test_execute_table_validations():
@@ -82,3 +82,15 @@ def test_execute_table_validations():
 
     merge_list = ExecuteTableValidations(t_document, HeaderFooterType.NONE, accuracy_percentage=98)
     assert merge_list == expected_merged_tables
+
+
+def test_execute_table_validations_does_not_change_document():
+    with open(os.path.join(current_folder, "data/gib_multi_page_table_merge.json")) as f:
+        j = json.load(f)
+    t_document = TDocument.from_dict(j)
+    merge_list = ExecuteTableValidations(t_document, HeaderFooterType.NONE, accuracy_percentage=98)
+    assert merge_list == [[
+        "5685498d-d196-42a7-8b40-594d6d886ca9", "a9191a66-0d32-4d36-8fd6-58e6917f4ea6",
+        "e0368543-c9c3-4616-bd6c-f25e66c859b2"
+    ]]
+    assert t_document.to_dict() == TDocument.from_dict(j).to_dict()
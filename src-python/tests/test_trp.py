@@ -1,7 +1,7 @@
 import json
 import pytest
 import os
-from trp import Document, Cell
+from trp import Document, Cell, Form, iterPages
 from typing import List
 import logging
 
@@ -197,3 +197,255 @@ def test_issue_83(caplog):
     j = json.load(f)
     doc = Document(j)
     assert doc
+
+
+def test_lazy_document():
+    p = os.path.dirname(os.path.realpath(__file__))
+    for datafile in ["multi-tables-multi-page-sample.json", "employment-application.json", "gib_multi_page_tables.json"]:
+        with open(os.path.join(p, "data", datafile)) as f:
+            j = json.load(f)
+        doc = Document(j)
+        lazy_doc = Document(j, lazy=True)
+        assert len(doc.pages) == len(lazy_doc.pages)
+        for page, lazy_page in zip(doc.pages, lazy_doc.pages):
+            assert lazy_page._lines is None and lazy_page._tables is None and lazy_page._form is None
+            assert page.id == lazy_page.id
+            assert lazy_page.tables is lazy_page.tables
+            assert lazy_page._lines is None
+            assert [str(t) for t in page.tables] == [str(t) for t in lazy_page.tables]
+            assert [str(f) for f in page.form.fields] == [str(f) for f in lazy_page.form.fields]
+            assert page.text == lazy_page.text
+            assert [type(c) for c in page.content] == [type(c) for c in lazy_page.content]
+            assert str(page) == str(lazy_page)
+
+
+def test_memory_per_block(caplog):
+    """
+    benchmark: memory held by a parsed Document per Textract block (logged), and no per-instance __dict__
+    on the compact v1 classes
+    """
+    import tracemalloc
+    caplog.set_level(logging.INFO)
+    j = return_json_for_file("data/request_for_verification_of_employment.json")
+    tracemalloc.start()
+    try:
+        doc = Document(j)
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    no_of_blocks = len(j['Blocks'])
+    logging.info(f"trp.Document memory per block: {allocated / no_of_blocks:.0f} bytes ({no_of_blocks} blocks)")
+
+    line = doc.pages[0].lines[0]
+    cell = doc.pages[0].tables[0].rows[0].cells[0]
+    for obj in [line, line.words[0], line.geometry, line.geometry.boundingBox, line.geometry.polygon[0], cell]:
+        assert not hasattr(obj, '__dict__')
+
+
+def test_shared_block_objects():
+    """every WORD block becomes one Word object, shared by lines, table cells and form fields"""
+    j = return_json_for_file("data/employment-application.json")
+    doc = Document(j)
+    page = doc.pages[0]
+    words_by_id = {word.id: word for line in page.lines for word in line.words}
+    cell_words = [w for table in page.tables for row in table.rows for cell in row.cells for w in cell.content]
+    field_words = [w for field in page.form.fields for w in field.key.content]
+    assert cell_words and field_words
+    for word in cell_words + field_words:
+        if word.id in words_by_id:
+            assert word is words_by_id[word.id]
+
+    merged_doc = Document(return_json_for_file("data/tables_with_merged_cells_sample1.json"))
+    table = [t for p in merged_doc.pages for t in p.tables if t.merged_cells][0]
+    cells_by_id = {cell.id: cell for row in table.rows for cell in row.cells}
+    for merged_cell in table.merged_cells:
+        for rs in merged_cell.block['Relationships']:
+            for cid in rs['Ids']:
+                assert cells_by_id[cid]._mergedCellParent is merged_cell
+
+
+def test_table_cell_grid():
+    doc = Document(return_json_for_file("data/tables_with_merged_cells_sample1.json"))
+    for page in doc.pages:
+        for table in page.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    assert table.cell(cell.rowIndex, cell.columnIndex) is cell
+                    assert table.get_cell_by_id(cell.id) is cell
+            assert table.cell(len(table.rows) + 1, 1) is None
+            assert table.get_cell_by_id("foo-bar-baz") is None
+
+
+def test_table_to_records():
+    doc = Document(return_json_for_file("data/tables_with_merged_cells_sample2.json"))
+    table = doc.pages[0].tables[1]
+    assert table.header is table.header
+    assert table.get_header_field_names() == [['Date', 'Description', 'Details', 'Debit', 'Charges Credit', 'Balance']]
+    assert table.column_headers[1] == 'Date'
+    records = table.to_records()
+    assert len(records) == len(table.rows_without_header) == 7
+    assert records[0]['Date'] == '02/02/22'
+    assert records[0]['Balance'] == '8000.00'
+
+
+def _table_response(header_rows, body_rows, merged_cells):
+    """
+    Textract response with one table. header_rows and body_rows are lists of cell texts (None: no WORD),
+    merged_cells a list of (text, [(RowIndex, ColumnIndex), ...]) for MERGED_CELL blocks
+    """
+    geometry = {
+        "BoundingBox": {"Width": 0.1, "Height": 0.1, "Left": 0.1, "Top": 0.1},
+        "Polygon": [{"X": 0.1, "Y": 0.1}, {"X": 0.2, "Y": 0.1}, {"X": 0.2, "Y": 0.2}, {"X": 0.1, "Y": 0.2}]
+    }
+    blocks = []
+    cell_ids = {}
+    for row_index, (texts, entity_types) in enumerate([(texts, ["COLUMN_HEADER"]) for texts in header_rows]
+                                                      + [(texts, []) for texts in body_rows], start=1):
+        for column_index, text in enumerate(texts, start=1):
+            cell = {"BlockType": "CELL", "Id": f"cell-{row_index}-{column_index}", "Confidence": 99.0,
+                    "Geometry": geometry, "RowIndex": row_index, "ColumnIndex": column_index, "RowSpan": 1,
+                    "ColumnSpan": 1, "EntityTypes": entity_types}
+            if text is not None:
+                word_id = f"word-{row_index}-{column_index}"
+                blocks.append({"BlockType": "WORD", "Id": word_id, "Confidence": 99.0, "Geometry": geometry,
+                               "Text": text})
+                cell["Relationships"] = [{"Type": "CHILD", "Ids": [word_id]}]
+            blocks.append(cell)
+            cell_ids[(row_index, column_index)] = cell["Id"]
+    table_relationships = [{"Type": "CHILD", "Ids": list(cell_ids.values())}]
+    merged_ids = []
+    for ix, (text, positions) in enumerate(merged_cells):
+        for position in positions:
+            cell = next(b for b in blocks if b["Id"] == cell_ids[position])
+            cell.pop("Relationships", None)
+        word_id = f"merged-word-{ix}"
+        blocks.append({"BlockType": "WORD", "Id": word_id, "Confidence": 99.0, "Geometry": geometry, "Text": text})
+        cell = next(b for b in blocks if b["Id"] == cell_ids[positions[0]])
+        cell["Relationships"] = [{"Type": "CHILD", "Ids": [word_id]}]
+        rows = [row for row, _ in positions]
+        columns = [column for _, column in positions]
+        blocks.append({"BlockType": "MERGED_CELL", "Id": f"merged-{ix}", "Confidence": 99.0, "Geometry": geometry,
+                       "RowIndex": min(rows), "ColumnIndex": min(columns), "RowSpan": max(rows) - min(rows) + 1,
+                       "ColumnSpan": max(columns) - min(columns) + 1,
+                       "Relationships": [{"Type": "CHILD", "Ids": [cell_ids[position] for position in positions]}]})
+        merged_ids.append(f"merged-{ix}")
+    if merged_ids:
+        table_relationships.append({"Type": "MERGED_CELL", "Ids": merged_ids})
+    table = {"BlockType": "TABLE", "Id": "table", "Confidence": 99.0, "Geometry": geometry,
+             "Relationships": table_relationships}
+    page = {"BlockType": "PAGE", "Id": "page", "Geometry": geometry,
+            "Relationships": [{"Type": "CHILD", "Ids": ["table"]}]}
+    return {"Blocks": [page, table] + blocks}
+
+
+def test_table_to_records_duplicate_headers():
+    # "Total" is one merged cell over columns 3 and 4 and both header rows, "Amount" is repeated by
+    # separate cells in both header rows of column 1
+    doc = Document(
+        _table_response(header_rows=[["Amount", "Amount", None, None], ["Amount", "Net", None, None]],
+                        body_rows=[["1", "2", "3", "4"]],
+                        merged_cells=[("Total", [(1, 3), (1, 4), (2, 3), (2, 4)])]))
+    table = doc.pages[0].tables[0]
+    assert table.column_headers == {1: 'Amount Amount', 2: 'Amount Net', 3: 'Total', 4: 'Total'}
+    assert table.to_records() == [{'Amount Amount': '1', 'Amount Net': '2', 'Total_3': '3', 'Total_4': '4'}]
+
+    # a repeated name in one header row, and a column without header text
+    doc = Document(_table_response(header_rows=[["Amount", "Amount", None]], body_rows=[["1", "2", "3"]],
+                                   merged_cells=[]))
+    assert doc.pages[0].tables[0].to_records() == [{'Amount_1': '1', 'Amount_2': '2', 3: '3'}]
+
+
+def _assert_lines_in_order(lines, expected_seq):
+    lines_lower = [line.lower() for line in lines]
+    positions = []
+    for expected in expected_seq:
+        matches = [ix for ix, line in enumerate(lines_lower) if expected in line]
+        assert matches, expected
+        positions.append(matches[0])
+    assert positions == sorted(positions)
+
+
+def test_lines_in_reading_order_multi_column():
+    doc = Document(return_json_for_file("data/test-multicol-response.json"))
+    lines = [text for _, text in doc.pages[0].getLinesInReadingOrder()]
+    assert len(lines) == len(doc.pages[0].lines)
+    _assert_lines_in_order(lines, [
+        "multi-column test document",
+        "a sample document with",
+        "this section has two columns",
+        "the left column contains",
+        "a horizontally separate right",
+        "this column has approximately",
+        "correct processing",
+        "a final footer",
+    ])
+    doc = Document(return_json_for_file("data/test-multicol-response-2.json"))
+    lines = [text for _, text in doc.pages[0].getLinesInReadingOrder()]
+    _assert_lines_in_order(lines, [
+        "heading of the page",
+        "section id",
+        "[enter]",
+        "two columns, both alike",
+        "from ancient grudge break",
+        "a glooming peace",
+        "go hence with caution",
+        "for never was a heuristic",
+        "in reading order",
+        "the end",
+        "page 1",
+    ])
+    assert doc.pages[0].getLinesInReadingOrder() is doc.pages[0].getLinesInReadingOrder()
+
+
+def test_text_in_reading_order_single_column():
+    doc = Document(return_json_for_file("data/little_women_page_1.json"))
+    text = doc.pages[0].getTextInReadingOrder()
+    assert text.startswith("The Project Gutenberg EBook of Little Women, by Louisa M. Alcott\n"
+                           "This eBook is for the use of anyone anywhere at no cost and with\n")
+    assert sorted(text.splitlines()) == sorted(line.text for line in doc.pages[0].lines)
+
+
+def test_form_key_index():
+    doc = Document(return_json_for_file("data/employment-application.json"))
+    form = doc.pages[0].form
+    assert form.getFieldsByKey("Phone Number:") == [form.getFieldByKey("Phone Number:")]
+    assert [f.key.text for f in form.searchFieldsByKey("ADDRESS")] == ["Home Address:", "Mailing Address:"]
+    assert [f.key.text for f in form.searchFieldsByKey("e")] == [f.key.text for f in form.fields]
+    assert [f.key.text for f in form.lookup("phone number")] == ["Phone Number:"]
+    assert form.lookup("home adress") == []
+    assert [f.key.text for f in form.lookup("home adress", fuzzy=True)] == ["Home Address:"]
+    results = doc.lookup_many(["Full Name", "mailing adres", "unknown key"], fuzzy=True)
+    assert [f.key.text for f in results["Full Name"]] == ["Full Name:"]
+    assert [f.key.text for f in results["mailing adres"]] == ["Mailing Address:"]
+    assert results["unknown key"] == []
+
+
+def test_form_key_index_multi_valued():
+    doc = Document(return_json_for_file("data/employment-application.json"))
+    form = Form()
+    for field in doc.pages[0].form.fields + doc.pages[0].form.fields:
+        form.addField(field)
+    assert len(form.getFieldsByKey("Full Name:")) == 2
+    assert len(form.lookup_many(["full name"])["full name"]) == 2
+
+
+def test_iter_pages_from_response_chunks():
+    j = return_json_for_file("data/multi-tables-multi-page-sample.json")
+    doc = Document(j)
+    chunk_size = 50
+    chunks_read: List[int] = list()
+
+    def response_chunks():
+        for ix in range(0, len(j["Blocks"]), chunk_size):
+            chunks_read.append(ix)
+            yield {"Blocks": j["Blocks"][ix:ix + chunk_size]}
+
+    pages = list()
+    for page in iterPages(response_chunks()):
+        if not pages:
+            # the first page is available before all chunks are read
+            assert len(chunks_read) < len(j["Blocks"]) / chunk_size
+        pages.append(page)
+    assert [p.id for p in pages] == [p.id for p in doc.pages]
+    for page, streamed_page in zip(doc.pages, pages):
+        assert str(page) == str(streamed_page)
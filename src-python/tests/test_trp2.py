@@ -1,8 +1,9 @@
 from typing import List
-from trp.t_pipeline import add_page_orientation, order_blocks_by_geo, order_blocks_by_geo_x_y, pipeline_merge_tables, add_kv_ocr_confidence, add_orientation_to_blocks
+from trp.t_pipeline import add_page_orientation, order_blocks_by_geo, order_blocks_by_geo_x_y, pipeline_merge_tables, add_kv_ocr_confidence, add_orientation_to_blocks, page_orientation, TPageOrientation, kv_ocr_confidence, _polygon_angles
 from trp.t_tables import MergeOptions, HeaderFooterType
 import trp.trp2 as t2
 import time
+import io
 import trp as t1
 import json
 import os
@@ -11,6 +12,7 @@ from trp import Document
 from uuid import uuid4
 import logging
 import re
+import statistics
 
 current_folder = os.path.dirname(os.path.realpath(__file__))
 
@@ -847,11 +849,19 @@ def test_kv_ocr_confidence(caplog):
     doc = t1.Document(t2.TDocumentSchema().dump(t_document))
     for page in doc.pages:
         k1 = page.form.getFieldByKey("Home Address:")
-        assert k1.key.custom['OCRConfidence'] == {'min': 95.0, 'mean': 99.26356930202908}
-        assert k1.value.custom['OCRConfidence'] == {'mean': 99.8596928914388, 'min': 99.74813079833984}
+        assert k1.key.custom['OCRConfidence']['min'] == 95.0
+        assert k1.key.custom['OCRConfidence']['mean'] == 99.26356930202908
+        assert k1.value.custom['OCRConfidence']['mean'] == 99.8596928914388
+        assert k1.value.custom['OCRConfidence']['min'] == 99.74813079833984
         k1 = page.form.getFieldByKey("Phone Number:")
-        assert k1.key.custom['OCRConfidence'] == {'mean': 97.33475685119629, 'min': 91.0}
-        assert k1.value.custom['OCRConfidence'] == {'mean': 99.23233032226562, 'min': 99.23233032226562}
+        assert k1.key.custom['OCRConfidence']['mean'] == 97.33475685119629
+        assert k1.key.custom['OCRConfidence']['min'] == 91.0
+        assert k1.value.custom['OCRConfidence'] == {
+            'mean': 99.23233032226562,
+            'min': 99.23233032226562,
+            'max': 99.23233032226562,
+            'p10': 99.23233032226562
+        }
         # for field in page.form.fields:
         #     print(
         #         f"{field.key.text} - {field.key.custom['OCRConfidence']}, {field.value.text} - {field.value.custom['OCRConfidence']}"
@@ -1105,3 +1115,606 @@ def test_create_geometry_from_blocks(caplog):
     no_geometry = t_document.find_block_by_id(id="5c860e58-deb4-4c24-8282-2394a2c535c0")
     assert no_geometry
     assert not t_document.create_geometry_from_blocks([no_geometry])
+
+
+def test_fast_load():
+    """
+    GIVEN: a Textract JSON response
+    WHEN: loaded with TDocument.from_dict / fast_load instead of TDocumentSchema().load
+    THEN: the resulting TDocument is the same
+    """
+    p = os.path.dirname(os.path.realpath(__file__))
+    for filename in [
+            "data/request_for_verification_of_employment.json", "data/gib_multi_page_tables.json",
+            "data/queries_sample.json", "data/tables_with_merged_cells_sample1.json"
+    ]:
+        with open(os.path.join(p, filename)) as f:
+            j = json.load(f)
+        t_document_schema: t2.TDocument = t2.TDocumentSchema().load(j)    #type: ignore
+        t_document_fast: t2.TDocument = t2.fast_load(j)
+        assert len(t_document_fast.blocks) == len(t_document_schema.blocks)
+        for block_fast, block_schema in zip(t_document_fast.blocks, t_document_schema.blocks):
+            assert vars(block_fast) == vars(block_schema)
+        assert t2.TDocumentSchema().dump(t_document_fast) == t2.TDocumentSchema().dump(t_document_schema)
+        assert t_document_fast.block_id_map() == t_document_schema.block_id_map()
+
+
+def test_fast_load_does_not_alias_input():
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    page = t_document.pages[0]
+    page.add_ids_to_relationships(["new-id"])
+    assert "new-id" not in [i for r in j["Blocks"][0]["Relationships"] for i in r["Ids"]]
+
+
+def test_to_dict_and_to_json():
+    """
+    GIVEN: a TDocument
+    WHEN: serialized with TDocument.to_dict / to_json instead of TDocumentSchema().dump / dumps
+    THEN: the output is the same and None values are left out
+    """
+    p = os.path.dirname(os.path.realpath(__file__))
+    for filename in ["data/employment-application.json", "data/queries_sample.json", "data/gib_multi_page_tables.json"]:
+        with open(os.path.join(p, filename)) as f:
+            j = json.load(f)
+        t_document: t2.TDocument = t2.TDocumentSchema().load(j)    #type: ignore
+        t_document.custom = {'orientation': 180}
+        assert t_document.to_dict() == t2.TDocumentSchema().dump(t_document)
+        assert t_document.to_json() == t2.TDocumentSchema().dumps(t_document)
+
+    t_document = t2.TDocument.from_dict(j)
+    t_document.blocks[0].confidence = None
+    t_document.blocks[0].geometry.bounding_box.top = None
+    assert "null" not in t_document.to_json()
+
+    out = io.StringIO()
+    t_document.to_json(fp=out)
+    assert json.loads(out.getvalue()) == t_document.to_dict()
+
+
+def test_relationships_recursive_is_per_document():
+    """
+    GIVEN: a TDocument
+    WHEN: relationships_recursive is called
+    THEN: the result is cached on the document, which can still be garbage collected,
+          and deep relationship chains do not hit the recursion limit
+    """
+    import gc
+    import sys
+    import weakref
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    page = t_document.pages[0]
+    descendants = t_document.relationships_recursive(page)
+    assert len(descendants) == len(t_document.blocks) - 1
+    assert t_document.relationships_recursive(page) == descendants
+    document_ref = weakref.ref(t_document)
+    del t_document, page
+    gc.collect()
+    assert document_ref() is None
+
+    depth = sys.getrecursionlimit() + 100
+    blocks = [t2.TBlock(id=str(i), block_type="WORD") for i in range(depth)]
+    for parent, child in zip(blocks, blocks[1:]):
+        parent.add_ids_to_relationships([child.id])
+    t_document = t2.TDocument(blocks=blocks)
+    assert len(t_document.relationships_recursive(blocks[0])) == depth - 1
+    # cycles are visited once
+    blocks[-1].add_ids_to_relationships([blocks[0].id])
+    t_document.__post_init__()
+    assert len(t_document.relationships_recursive(blocks[0])) == depth
+
+
+def test_get_blocks_by_type_index():
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/employment-application.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    page = t_document.pages[0]
+    descendants = t_document.relationships_recursive(page)
+    for block_type in [t2.TextractBlockTypes.KEY_VALUE_SET, t2.TextractBlockTypes.WORD, t2.TextractBlockTypes.TABLE]:
+        expected = [b for b in descendants if b.block_type == block_type.name]
+        blocks = t_document.get_blocks_by_type(page=page, block_type_enum=block_type)
+        assert len(blocks) == len(expected) and set(blocks) == set(expected)
+        # callers get their own list
+        blocks.clear()
+        assert len(t_document.get_blocks_by_type(page=page, block_type_enum=block_type)) == len(expected)
+        assert t_document.get_blocks_by_type(block_type_enum=block_type) == [
+            b for b in t_document.blocks if b.block_type == block_type.name
+        ]
+    assert len(t_document.forms(page=page)) == len([b for b in descendants if b.block_type == "KEY_VALUE_SET"])
+    assert t_document.signatures(page=page) == []
+    assert len(t_document.get_blocks_by_type(page=page)) == len(descendants)
+
+
+def test_page_lookups():
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib_multi_page_tables.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    pages = t_document.pages
+    assert [page.page for page in pages] == list(range(1, len(pages) + 1))
+    pages.reverse()
+    assert [page.page for page in t_document.pages] == list(range(1, len(pages) + 1))
+    for page in t_document.pages:
+        assert t_document.page_by_number(page.page) is page
+        assert t_document.page_of(page) is page
+        for table in t_document.tables(page=page):
+            assert t_document.page_of(table) is page
+    assert t_document.page_by_number(len(pages) + 1) is None
+    assert t_document.page_of(t2.TBlock(id="not-in-document")) is None
+
+    new_page = t2.TBlock(id=str(uuid4()), block_type="PAGE", page=len(pages) + 1)
+    t_document.add_block(new_page)
+    assert t_document.pages[-1] is new_page
+    assert t_document.page_by_number(len(pages) + 1) is new_page
+
+
+def test_parents_and_ancestors():
+    """
+    GIVEN: a TDocument with forms and tables
+    WHEN: looking up parents, ancestors and the page of blocks, also after add_block and delete_blocks
+    THEN: the results match the relationships of the blocks
+    """
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/employment-application.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    page = t_document.pages[0]
+    line = t_document.lines(page=page)[0]
+    word = t_document.get_blocks_for_relationships(line.get_relationships_for_type())[0]
+    assert line in t_document.parents(word)
+    assert t_document.parents(word, relationship_type="VALUE") == []
+    assert t_document.parents(line) == [page]
+    assert t_document.ancestors(word)[0] == line
+    assert page in t_document.ancestors(word)
+    assert t_document.page_of(word) is page
+
+    key = t_document.keys(page=page)[0]
+    value = t_document.get_blocks_for_relationships(key.get_relationships_for_type("VALUE"))[0]
+    assert t_document.parents(value, relationship_type="VALUE") == [key]
+    table = t_document.tables(page=page)[0]
+    cell = t_document.get_blocks_for_relationships(table.get_relationships_for_type())[0]
+    assert table in t_document.parents(cell, relationship_type="CHILD")
+
+    new_key = t_document.add_key_values(key_name="new key", values=[word], page_block=page)
+    new_value = t_document.get_blocks_for_relationships(new_key.get_relationships_for_type("VALUE"))[0]
+    assert t_document.parents(new_value, relationship_type="VALUE") == [new_key]
+    assert new_value in t_document.parents(word)
+    assert t_document.page_of(new_key) is page
+
+    t_document.delete_blocks([new_key.id, line.id])
+    assert t_document.parents(new_value, relationship_type="VALUE") == []
+    assert t_document.parents(word) == t2.TDocument.from_dict(t_document.to_dict()).parents(word)
+    assert line not in t_document.parents(word)
+
+
+def test_batch_mutations():
+    """
+    GIVEN: a TDocument
+    WHEN: adding keys and deleting blocks inside a batch
+    THEN: the deletes are applied when the batch ends and the result is the same as without the batch
+    """
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/employment-application.json")) as f:
+        j = json.load(f)
+
+    def mutate(t_document: t2.TDocument):
+        page = t_document.pages[0]
+        words = t_document.get_blocks_by_type(page=page, block_type_enum=t2.TextractBlockTypes.WORD)
+        for idx, word in enumerate(words[:20]):
+            t_document.add_key_values(key_name=f"key {idx}", values=[word], page_block=page)
+        t_document.delete_blocks([line.id for line in t_document.lines(page=page)[:5]])
+
+    t_document = t2.TDocument.from_dict(j)
+    mutate(t_document)
+    batch_document = t2.TDocument.from_dict(j)
+    lines = batch_document.lines(page=batch_document.pages[0])
+    with batch_document.batch():
+        mutate(batch_document)
+        with batch_document.batch():
+            batch_document.delete_blocks([lines[5].id])
+        assert batch_document.find_block_by_id(lines[0].id) is lines[0]
+        assert batch_document.find_block_by_id(lines[5].id) is lines[5]
+    assert batch_document.find_block_by_id(lines[0].id) is None
+    assert batch_document.find_block_by_id(lines[5].id) is None
+    assert len(batch_document.blocks) == len(t_document.blocks) - 1 == len(j["Blocks"]) + 20 * 3 - 6
+    assert [b.text for b in batch_document.blocks] == [b.text for b in t_document.blocks if b.id != lines[5].id]
+    assert batch_document.block_id_map() == {b.id: idx for idx, b in enumerate(batch_document.blocks)}
+
+    with pytest.raises(KeyError):
+        with batch_document.batch():
+            batch_document.delete_blocks(["not-in-document"])
+
+
+def test_relationship_ids_membership():
+    import copy
+    relationship = t2.TRelationship(type="CHILD", ids=["a", "b"])
+    assert isinstance(relationship.ids, t2.TIdList)
+    assert relationship.ids == ["a", "b"] and "a" in relationship.ids and "c" not in relationship.ids
+    relationship.ids.extend(x for x in ["b", "c", "c"] if x not in relationship.ids)
+    assert relationship.ids == ["a", "b", "c"]
+    relationship.ids.remove("a")
+    assert "a" not in relationship.ids
+    relationship.ids[0] = "d"
+    assert "b" not in relationship.ids and "d" in relationship.ids
+    del relationship.ids[-1]
+    assert "c" not in relationship.ids and relationship.ids[-1] == "d"
+    relationship.ids = ["e"]
+    assert isinstance(relationship.ids, t2.TIdList) and "e" in relationship.ids
+    ids_copy = copy.deepcopy(relationship.ids)
+    ids_copy.remove("e")
+    assert "e" not in ids_copy and "e" in relationship.ids
+    assert t2.TRelationshipSchema().dump(relationship) == relationship.to_dict() == {"Type": "CHILD", "Ids": ["e"]}
+    assert json.dumps(relationship.to_dict()) == '{"Type": "CHILD", "Ids": ["e"]}'
+
+    block = t2.TBlock(id="block", block_type="PAGE")
+    ids = [str(i) for i in range(20000)]
+    block.add_ids_to_relationships(ids)
+    block.add_ids_to_relationships(ids)
+    assert block.relationships[0].ids == ids
+    assert block.relationships[0].ids is not ids
+
+
+def test_merge_tables_chain():
+    """
+    GIVEN: a table continued over 3 pages
+    WHEN: merging the 3 tables
+    THEN: the rows of the last table follow the rows of the second, the cells belong to the first table
+          and the other 2 TABLE blocks are deleted
+    """
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib_multi_page_table_merge.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    tbl_ids = ['5685498d-d196-42a7-8b40-594d6d886ca9', 'a9191a66-0d32-4d36-8fd6-58e6917f4ea6',
+               'e0368543-c9c3-4616-bd6c-f25e66c859b2']
+    tables = [t_document.get_block_by_id(tbl_id) for tbl_id in tbl_ids]
+    cells = [t_document.get_blocks_for_relationships(table.get_relationships_for_type()) for table in tables]
+    rows = [max(cell.row_index for cell in table_cells) for table_cells in cells]
+    last_cell = cells[2][-1]
+    assert t_document.parents(last_cell) == [tables[2]]
+    t_document.merge_tables([list(tbl_ids)])
+    assert t_document.find_block_by_id(tbl_ids[1]) is None
+    assert t_document.find_block_by_id(tbl_ids[2]) is None
+    assert tables[0].get_relationships_for_type().ids == [cell.id for table_cells in cells for cell in table_cells]
+    assert last_cell.row_index == sum(rows)
+    assert t_document.parents(last_cell) == [tables[0]]
+    assert t_document.page_of(last_cell) is t_document.pages[0]
+
+
+def test_merge_tables_chained_groups():
+    """
+    GIVEN: merge groups where a later group uses a table already merged by an earlier group, or a parent table
+           without cells
+    WHEN: merging the tables
+    THEN: the already merged table is reported as missing before any table is changed and a table is only
+          deleted when it was merged
+    """
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib_multi_page_table_merge.json")) as f:
+        j = json.load(f)
+    tbl_id1, tbl_id2, tbl_id3 = ['5685498d-d196-42a7-8b40-594d6d886ca9', 'a9191a66-0d32-4d36-8fd6-58e6917f4ea6',
+                                 'e0368543-c9c3-4616-bd6c-f25e66c859b2']
+    for table_array_ids in [[[tbl_id1, tbl_id2], [tbl_id2, tbl_id3]], [[tbl_id1, tbl_id2], [tbl_id3, tbl_id2]]]:
+        t_document = t2.TDocument.from_dict(j)
+        original = t2.TDocument.from_dict(j)
+        with pytest.raises(ValueError, match=f"no block for id: {tbl_id2}"):
+            t_document.merge_tables(table_array_ids)
+        assert t_document.to_dict() == original.to_dict()
+        for tbl_id in [tbl_id1, tbl_id2, tbl_id3]:
+            cell = t_document.get_blocks_for_relationships(
+                t_document.get_block_by_id(tbl_id).get_relationships_for_type())[-1]
+            assert t_document.parents(cell) == [t_document.get_block_by_id(tbl_id)]
+
+    t_document = t2.TDocument.from_dict(j)
+    t_document.get_block_by_id(tbl_id1).relationships = []
+    t_document.merge_tables([[tbl_id1, tbl_id2]])
+    assert t_document.find_block_by_id(tbl_id2) is not None
+    assert t_document.get_block_by_id(tbl_id1).relationships == []
+
+
+def test_lines_between():
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib_multi_page_table_merge.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    for page in t_document.pages:
+        lines = t_document.get_blocks_by_type(page=page, block_type_enum=t2.TextractBlockTypes.LINE)
+        for y0, y1 in [(0, 0.1), (0.9, 1), (0.25, 0.5), (0, 1), (0.5, 0.25)]:
+            top_lines = t_document.lines_between(page, y0, y1)
+            assert set(top_lines) == {line for line in lines if y0 < line.geometry.bounding_box.top < y1}
+            assert [line.geometry.bounding_box.top for line in top_lines] == sorted(
+                line.geometry.bounding_box.top for line in top_lines)
+            bottom_lines = t_document.lines_between(page, y0, y1, edge="bottom")
+            assert set(bottom_lines) == {line for line in lines if y0 < line.geometry.bounding_box.bottom < y1}
+    with pytest.raises(ValueError):
+        t_document.lines_between(t_document.pages[0], 0, 1, edge="left")
+
+    page = t_document.pages[0]
+    header_lines = t_document.lines_between(page, 0, 0.2)
+    t_document.rotate(page=page, degrees=180)
+    assert set(t_document.lines_between(page, 0.8, 1, edge="bottom")) == set(header_lines)
+
+    # scaled pages are sorted again, also when scaled through the geometry store
+    t_document.scale(page, 1000, 2000)
+    assert set(t_document.lines_between(page, 1600, 2000, edge="bottom")) == set(header_lines)
+    t_document.ratio(page, 1000, 2000)
+    assert set(t_document.lines_between(page, 0.8, 1, edge="bottom")) == set(header_lines)
+
+
+def test_lines_between_with_geometry_store():
+    pytest.importorskip("numpy")
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib_multi_page_table_merge.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    page = t_document.pages[0]
+    header_lines = t_document.lines_between(page, 0, 0.2)
+    store = t_document.geometry_store()
+    store.scale(1000, 2000)
+    assert set(t_document.lines_between(page, 0, 400)) == set(header_lines)
+    store.ratio(1000, 2000, rows=store.rows_for(t_document.relationships_recursive(page)))
+    assert set(t_document.lines_between(page, 0, 0.2)) == set(header_lines)
+    t_document.scale(page, 1000, 2000)
+    assert set(t_document.lines_between(page, 0, 400)) == set(header_lines)
+
+
+def test_geometry_store():
+    np = pytest.importorskip("numpy")
+    from trp.t_geometry import TGeometryStore, TOP, LEFT
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/employment-application.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    expected = t2.TDocument.from_dict(j)
+    store = t_document.geometry_store()
+    assert t_document.geometry_store() is store
+    assert len(store) == len(t_document.blocks)
+    assert t_document.to_dict() == expected.to_dict()
+    for block, expected_block in zip(t_document.blocks, expected.blocks):
+        assert block.geometry.bounding_box == expected_block.geometry.bounding_box
+        assert block.geometry.polygon == expected_block.geometry.polygon
+        assert store.polygon(store.row_by_id[block.id]).tolist() == [p.to_list() for p in expected_block.geometry.polygon]
+
+    # writes through the block geometry end up in the arrays and the other way around
+    block = t_document.blocks[1]
+    row = store.row_by_id[block.id]
+    block.geometry.bounding_box.top = 0.25
+    assert store.boxes[row, TOP] == 0.25
+    store.boxes[row, LEFT] = 0.5
+    assert block.geometry.bounding_box.left == 0.5
+    block.geometry.polygon[0].x = None
+    assert np.isnan(store.polygon(row)[0, 0]) and "X" not in block.geometry.polygon[0].to_dict()
+    t_document = t2.TDocument.from_dict(j)
+    store = t_document.geometry_store()
+
+    page = t_document.pages[0]
+    words = t_document.get_blocks_by_type(page=page, block_type_enum=t2.TextractBlockTypes.WORD)
+    rows = store.rows_for(words)
+    assert store.blocks_for(store.order(rows)) == sorted(words, key=lambda b: b.geometry.bounding_box.top)
+    header = store.blocks_for(rows[store.overlapping(rows, left=0, top=0, width=1, height=0.2)])
+    assert header == [
+        w for w in words if w.geometry.bounding_box.top < 0.2 and w.geometry.bounding_box.left < 1
+        and w.geometry.bounding_box.bottom > 0 and w.geometry.bounding_box.right > 0
+    ]
+
+    store.scale(doc_width=1000, doc_height=2000, rows=rows)
+    for word in words:
+        word_expected = expected.get_block_by_id(word.id)
+        word_expected.geometry.scale(doc_width=1000, doc_height=2000)
+        assert word.geometry.bounding_box.to_list() == pytest.approx(word_expected.geometry.bounding_box.to_list())
+        for point, point_expected in zip(word.geometry.polygon, word_expected.geometry.polygon):
+            assert point.to_list() == pytest.approx(point_expected.to_list())
+    assert page.geometry.bounding_box == expected.pages[0].geometry.bounding_box
+    store.ratio(doc_width=1000, doc_height=2000, rows=rows)
+    assert words[0].geometry.bounding_box.top == pytest.approx(expected.get_block_by_id(words[0].id).geometry.bounding_box.top / 2000)
+
+    t_document.add_virtual_block(text="new", page_block=page)
+    assert len(t_document.geometry_store()) == len(t_document.blocks)
+    assert TGeometryStore([]).boxes.shape == (0, 4)
+
+
+def test_rotate_right_angles_and_page():
+    """
+    GIVEN: a page
+    WHEN: rotating by multiples of 90 degrees or by any angle, block by block, for the whole page, and with the geometry store
+    THEN: right angles are exact swaps, bounding boxes and polygons are rotated by the same angle
+          and all ways give the same result
+    """
+    assert t2.cos_sin_for_degrees(90) == (0.0, 1.0)
+    assert t2.cos_sin_for_degrees(-90) == (0.0, -1.0)
+    assert t2.cos_sin_for_degrees(540) == (-1.0, 0.0)
+    assert t2.TPoint(0.25, 0.75).rotate(degrees=90) == t2.TPoint(0.25, 0.25)
+    assert t2.TPoint(0.25, 0.75).rotate(degrees=180) == t2.TPoint(0.75, 0.25)
+    assert t2.TPoint(0.25, 0.75).rotate(degrees=-90) == t2.TPoint(0.75, 0.75)
+    geometry = t2.TGeometry(bounding_box=t2.TBoundingBox(width=0.5, height=0.25, left=0.25, top=0.5),
+                            polygon=[t2.TPoint(0.25, 0.5), t2.TPoint(0.75, 0.5)])
+    geometry.rotate(origin=t2.TPoint(0.5, 0.5), degrees=90)
+    assert geometry.bounding_box == t2.TBoundingBox(width=0.25, height=0.5, left=0.25, top=0.25)
+    assert geometry.polygon == [t2.TPoint(0.5, 0.25), t2.TPoint(0.5, 0.75)]
+
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib__90_degrees.json")) as f:
+        j = json.load(f)
+    for degrees in [-90, 10, 180]:
+        block_by_block = t2.TDocument.from_dict(j)
+        page = block_by_block.pages[0]
+        for block in block_by_block.relationships_recursive(page):
+            block.geometry.rotate(origin=t2.TPoint(0.5, 0.5), degrees=degrees)
+        t_document = t2.TDocument.from_dict(j)
+        t_document.rotate(page=t_document.pages[0], degrees=degrees)
+        assert t_document.to_dict() == block_by_block.to_dict()
+
+
+def test_rotate_page_with_geometry_store():
+    pytest.importorskip("numpy")
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib__90_degrees.json")) as f:
+        j = json.load(f)
+    for degrees in [-90, 10, 180]:
+        expected = t2.TDocument.from_dict(j)
+        expected.rotate(page=expected.pages[0], degrees=degrees)
+        t_document = t2.TDocument.from_dict(j)
+        t_document.geometry_store()
+        t_document.rotate(page=t_document.pages[0], degrees=degrees)
+        assert t_document.to_dict() == expected.to_dict()
+
+
+def test_page_orientation_statistics():
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib_10_degrees.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    page = t_document.pages[0]
+    orientation = page_orientation(t_document, page)
+    words_and_lines = [
+        b for b in t_document.get_child_relations(page=page) if b.block_type in ("WORD", "LINE")
+    ]
+    assert sum(orientation.histogram.values()) == len(words_and_lines)
+    assert 5 < orientation.mode < 15
+    assert orientation.histogram[orientation.mode] == max(orientation.histogram.values())
+    assert orientation.confidence == orientation.histogram[orientation.mode] / len(words_and_lines)
+    assert add_page_orientation(t_document).pages[0].custom['PageOrientationBasedOnWords'] == orientation.mode
+    assert page_orientation(t_document, t2.TBlock(id="empty-page", block_type="PAGE")) == TPageOrientation()
+
+
+def test_page_orientation_with_geometry_store():
+    pytest.importorskip("numpy")
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib_10_degrees.json")) as f:
+        j = json.load(f)
+    expected = t2.TDocument.from_dict(j)
+    t_document = t2.TDocument.from_dict(j)
+    t_document.geometry_store()
+    assert page_orientation(t_document, t_document.pages[0]) == page_orientation(expected, expected.pages[0])
+    add_orientation_to_blocks(expected)
+    add_orientation_to_blocks(t_document)
+    for block, expected_block in zip(t_document.blocks, expected.blocks):
+        assert block.custom['Orientation'] == pytest.approx(expected_block.custom['Orientation'])
+
+    # blocks not in the store do not shift the angles of the other blocks
+    words = t_document.get_blocks_by_type(block_type_enum=t2.TextractBlockTypes.WORD)[:3]
+    outside_word = t2.TBlock(id="not-in-store", block_type="WORD", geometry=words[1].geometry)
+    words_and_outside_word = [words[0], outside_word, words[2]]
+    assert t_document.has_geometry_store()
+    assert _polygon_angles(t_document, words_and_outside_word) == pytest.approx(
+        _polygon_angles(expected, words_and_outside_word))
+
+
+def test_order_blocks_by_geo_x_y_lines_only():
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib.json")) as f:
+        j = json.load(f)
+    t_document = order_blocks_by_geo_x_y(t2.TDocument.from_dict(j), lines_only=True)
+    blocks = t_document.blocks_in_reading_order()
+    assert len(blocks) == len(j["Blocks"])
+    lines = [b for b in blocks if b.block_type == "LINE"]
+    assert [b.geometry.bounding_box.top for b in lines][0] == min(b.geometry.bounding_box.top for b in lines)
+    for line in lines:
+        idx = blocks.index(line)
+        words = t_document.get_blocks_for_relationships(line.get_relationships_for_type())
+        assert blocks[idx + 1:idx + 1 + len(words)] == words
+    doc = t1.Document(t2.TDocumentSchema().dump(t_document))
+    assert "Value 1.1.1" == doc.pages[0].tables[0].rows[0].cells[0].text.strip()
+
+    # blocks without geometry (e.g. QUERY) do not stop the ordering
+    with open(os.path.join(p, "data/queries_sample.json")) as f:
+        j = json.load(f)
+    t_document = order_blocks_by_geo_x_y(t2.TDocument.from_dict(j))
+    assert sorted(b.id for b in t_document.blocks) == sorted(b["Id"] for b in j["Blocks"])
+
+
+def test_reading_order_does_not_change_blocks():
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/gib_multi_page_tables.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    original_blocks = list(t_document.blocks)
+    block_id_map = dict(t_document.block_id_map())
+    assert not t_document.has_reading_order()
+    assert t_document.reading_order() == list(range(len(original_blocks)))
+
+    t_document = order_blocks_by_geo(t_document)
+    assert t_document.has_reading_order()
+    assert t_document.blocks == original_blocks
+    assert t_document.block_id_map() == block_id_map
+    ordered = t_document.blocks_in_reading_order()
+    assert sorted(t_document.reading_order()) == list(range(len(original_blocks)))
+    assert [b["Id"] for b in t_document.to_dict()["Blocks"]] == [b.id for b in ordered]
+    assert t2.TDocumentSchema().dump(t_document)["Blocks"] == t_document.to_dict()["Blocks"]
+    for page in t_document.pages:
+        page_blocks = ordered[ordered.index(page) + 1:ordered.index(page) + 1 +
+                              len(t_document.relationships_recursive(page))]
+        tops = [b.geometry.bounding_box.top for b in page_blocks]
+        assert tops == sorted(tops)
+    doc = t1.Document(t_document.to_dict())
+    assert "Page 1 - Value 1.1.1" == doc.pages[0].tables[0].rows[0].cells[0].text.strip()
+
+    # deleted blocks leave the order, the other blocks keep their place in it
+    word = next(b for b in ordered if b.block_type == "WORD")
+    line = t_document.parents(word)[0]
+    line.get_relationships_for_type().ids.remove(word.id)
+    t_document.delete_blocks([word.id])
+    assert t_document.blocks_in_reading_order() == [b for b in ordered if b is not word]
+    # blocks added later follow the ordered blocks of their page
+    new_word = t2.TBlock(id="new-word", block_type="WORD", text="new")
+    t_document.add_block(new_word, page=t_document.pages[0])
+    page_1_end = t_document.blocks_in_reading_order().index(t_document.pages[1])
+    assert t_document.blocks_in_reading_order()[page_1_end - 1] is new_word
+    assert line in t_document.blocks_in_reading_order()
+
+
+def test_reading_order_after_merge_tables():
+    """
+    GIVEN: a document ordered by geo
+    WHEN: tables are merged, which leaves the ids of the merged tables in the PAGE relationships
+    THEN: the reading order skips those ids and the document dumps without the merged tables
+    """
+    p = os.path.dirname(os.path.realpath(__file__))
+    for file_name in ["data/gib_multi_page_table_merge.json", "data/gib_multi_tables_multi_page_sample.json"]:
+        with open(os.path.join(p, file_name)) as f:
+            j = json.load(f)
+        t_document = order_blocks_by_geo(t2.TDocumentSchema().load(j))    # type: ignore
+        table_ids = set(t_document.block_id_map(t2.TextractBlockTypes.TABLE))
+        t_document = pipeline_merge_tables(t_document, MergeOptions.MERGE, None, HeaderFooterType.NONE)
+        merged_table_ids = table_ids - set(t_document.block_id_map(t2.TextractBlockTypes.TABLE))
+        assert merged_table_ids
+        assert sorted(t_document.reading_order()) == list(range(len(t_document.blocks)))
+        dumped_ids = [b["Id"] for b in t2.TDocumentSchema().dump(t_document)["Blocks"]]
+        assert dumped_ids == [b["Id"] for b in t_document.to_dict()["Blocks"]]
+        assert sorted(dumped_ids) == sorted(b.id for b in t_document.blocks)
+        assert not merged_table_ids & set(dumped_ids)
+
+
+def test_kv_ocr_confidence_statistics():
+    p = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(p, "data/employment-application.json")) as f:
+        j = json.load(f)
+    t_document = t2.TDocument.from_dict(j)
+    confidence_by_id = kv_ocr_confidence(t_document, percentile=50)
+    assert confidence_by_id
+    for key_value_block in t_document.forms():
+        confidences = [float(b.confidence) for b in t_document.get_child_relations(key_value_block) if b.confidence]
+        if not confidences:
+            assert key_value_block.id not in confidence_by_id
+            continue
+        ocr_confidence = confidence_by_id[key_value_block.id]
+        assert ocr_confidence['mean'] == pytest.approx(sum(confidences) / len(confidences))
+        assert ocr_confidence['min'] == min(confidences)
+        assert ocr_confidence['max'] == max(confidences)
+        assert ocr_confidence['p50'] == pytest.approx(statistics.median(confidences))
+
+    # relationships without ids and KEY_VALUE_SET blocks not on a page are skipped
+    key_value_block = t_document.forms()[0]
+    key_value_block.relationships.append(t2.TRelationship(type="VALUE", ids=None))    # type: ignore
+    t_document.add_block(t2.TBlock(id="no-page-key", block_type="KEY_VALUE_SET", entity_types=["KEY"]))
+    t_document.pages[0].relationships[0].ids.remove("no-page-key")
+    t_document.add_block(t2.TBlock(id="no-page-word", block_type="WORD", confidence=50))
+    t_document.get_block_by_id("no-page-key").add_ids_to_relationships(["no-page-word"])
+    t_document.__post_init__()
+    assert kv_ocr_confidence(t_document, percentile=50) == confidence_by_id
@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 """Top-level package for amazon-textract-response-parser."""
 import logging
-from typing import List
+import re
+from bisect import insort
+from collections import Counter, deque
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 from logging import NullHandler
 
 logging.getLogger(__name__).addHandler(NullHandler())
@@ -14,7 +17,35 @@ ENTITY_TYPE_COLUMN_HEADER = "COLUMN_HEADER"
 ENTITY_TYPE_MERGED_CELL = "MERGED_CELL"
 
 
+class BlockMap(dict):
+    """
+    Block id -> Textract block dict, plus a registry of the objects already built for those blocks.
+    Document uses one BlockMap per document so that every WORD, SELECTION_ELEMENT, LINE, CELL and TABLE
+    block becomes exactly one object, shared by all containers (lines, fields, cells, merged cells) referencing it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._blockObjects = {}
+
+    def getBlockObject(self, blockId, blockClass):
+        blockObject = self._blockObjects.get(blockId)
+        if blockObject is None:
+            blockObject = blockClass(self[blockId], self)
+            self._blockObjects[blockId] = blockObject
+        return blockObject
+
+
+def _getBlockObject(blockMap, blockId, blockClass):
+    # plain dicts (classes used without a Document) have no registry, build a new object then
+    if isinstance(blockMap, BlockMap):
+        return blockMap.getBlockObject(blockId, blockClass)
+    return blockClass(blockMap[blockId], blockMap)
+
+
 class BaseBlock():
+    # __slots__ instead of a per-instance __dict__ keeps the (many) block objects of large documents small
+    __slots__ = ('_block', '_confidence', '_geometry', '_id', '_text', '_text_type', '_custom')
 
     def __init__(self, block, blockMap):
         self._block = block
@@ -67,6 +98,7 @@ class BaseBlock():
 
 
 class BoundingBox:
+    __slots__ = ('_width', '_height', '_left', '_top')
 
     def __init__(self, width, height, left, top):
         self._width = width
@@ -95,6 +127,7 @@ class BoundingBox:
 
 
 class Polygon:
+    __slots__ = ('_x', '_y')
 
     def __init__(self, x, y):
         self._x = x
@@ -113,6 +146,7 @@ class Polygon:
 
 
 class Geometry:
+    __slots__ = ('_boundingBox', '_polygon')
 
     def __init__(self, geometry):
         boundingBox = geometry["BoundingBox"]
@@ -139,12 +173,14 @@ class Geometry:
 
 
 class Word(BaseBlock):
+    __slots__ = ()
 
     def __init__(self, block, blockMap):
         super().__init__(block, blockMap)
 
 
 class Line(BaseBlock):
+    __slots__ = ('_words', )
 
     def __init__(self, block, blockMap):
         super().__init__(block, blockMap)
@@ -155,7 +191,7 @@ class Line(BaseBlock):
                 if (rs['Type'] == 'CHILD'):
                     for cid in rs['Ids']:
                         if (blockMap[cid]["BlockType"] == "WORD"):
-                            self._words.append(Word(blockMap[cid], blockMap))
+                            self._words.append(_getBlockObject(blockMap, cid, Word))
 
     def __str__(self):
         s = "Line\n==========\n"
@@ -171,6 +207,7 @@ class Line(BaseBlock):
 
 
 class SelectionElement:
+    __slots__ = ('_confidence', '_geometry', '_id', '_selectionStatus')
 
     def __init__(self, block, blockMap):
         self._confidence = block['Confidence']
@@ -206,7 +243,7 @@ class FieldKey(BaseBlock):
         for eid in children:
             wb = blockMap[eid]
             if (wb['BlockType'] == "WORD"):
-                w = Word(wb, blockMap)
+                w = _getBlockObject(blockMap, eid, Word)
                 self._content.append(w)
                 t.append(w.text)
 
@@ -229,11 +266,11 @@ class FieldValue(BaseBlock):
         for eid in children:
             wb = blockMap[eid]
             if (wb['BlockType'] == "WORD"):
-                w = Word(wb, blockMap)
+                w = _getBlockObject(blockMap, eid, Word)
                 self._content.append(w)
                 t.append(w.text)
             elif (wb['BlockType'] == "SELECTION_ELEMENT"):
-                se = SelectionElement(wb, blockMap)
+                se = _getBlockObject(blockMap, eid, SelectionElement)
                 self._content.append(se)
                 self._text = se.selectionStatus
 
@@ -287,15 +324,131 @@ class Field(BaseBlock):
         return self._value
 
 
+_NON_ALPHANUMERIC = re.compile(r'[\W_]+')
+
+
+def _normalizeKey(key):
+    """lower case tokens without punctuation, e.g. 'Phone Number:' -> 'phone number'"""
+    return ' '.join(_NON_ALPHANUMERIC.sub(' ', key.lower()).split())
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class KeyIndex:
+    """
+    Index over the key texts of form fields. Built incrementally when fields are added, so a lookup does not
+    scan all fields:
+    - exact key text and normalised key (see _normalizeKey) -> all fields with that key
+    - trigrams of the lower case key text for case-insensitive substring search
+    - trigrams of the normalised key for fuzzy (n-gram similarity) lookup
+    """
+
+    def __init__(self, fields: Optional[Iterable] = None):
+        self._fields = []
+        self._lowerKeys: List[str] = []
+        self._exact: Dict[str, List[int]] = {}
+        self._normalized: Dict[str, List[int]] = {}
+        self._substringGrams: Dict[str, List[int]] = {}
+        self._fuzzyGrams: Dict[str, List[int]] = {}
+        self._fuzzyGramCounts: List[int] = []
+        if fields:
+            for field in fields:
+                self.add(field)
+
+    def add(self, field):
+        position = len(self._fields)
+        text = field.key.text
+        lowerKey = text.lower()
+        normalizedKey = _normalizeKey(text)
+        self._fields.append(field)
+        self._lowerKeys.append(lowerKey)
+        self._exact.setdefault(text, []).append(position)
+        self._normalized.setdefault(normalizedKey, []).append(position)
+        for gram in _trigrams(lowerKey):
+            self._substringGrams.setdefault(gram, []).append(position)
+        fuzzyGrams = _trigrams(f"  {normalizedKey} ")
+        for gram in fuzzyGrams:
+            self._fuzzyGrams.setdefault(gram, []).append(position)
+        self._fuzzyGramCounts.append(len(fuzzyGrams))
+
+    def exact(self, key: str) -> List:
+        """all fields with exactly this key text"""
+        return [self._fields[position] for position in self._exact.get(key, [])]
+
+    def normalized(self, key: str) -> List:
+        """all fields whose key matches after normalisation (case, punctuation and whitespace are ignored)"""
+        return [self._fields[position] for position in self._normalized.get(_normalizeKey(key), [])]
+
+    def search(self, key: str) -> List:
+        """all fields whose key text contains key (case-insensitive), in field order"""
+        searchKey = key.lower()
+        grams = _trigrams(searchKey)
+        if not grams:
+            candidates = range(len(self._fields))
+        else:
+            postings = [self._substringGrams.get(gram, []) for gram in grams]
+            postings.sort(key=len)
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+                if not candidates:
+                    break
+            candidates = sorted(candidates)
+        return [self._fields[position] for position in candidates if searchKey in self._lowerKeys[position]]
+
+    def fuzzy(self, key: str, minSimilarity: float = 0.5) -> List[Tuple[float, object]]:
+        """
+        (similarity, field) for all fields whose normalised key has a trigram Dice similarity of at least
+        minSimilarity with key, best match first
+        """
+        grams = _trigrams(f"  {_normalizeKey(key)} ")
+        if not grams:
+            return []
+        shared: Dict[int, int] = {}
+        for gram in grams:
+            for position in self._fuzzyGrams.get(gram, []):
+                shared[position] = shared.get(position, 0) + 1
+        results = []
+        for position, count in shared.items():
+            similarity = 2 * count / (len(grams) + self._fuzzyGramCounts[position])
+            if similarity >= minSimilarity:
+                results.append((similarity, position))
+        results.sort(key=lambda x: (-x[0], x[1]))
+        return [(similarity, self._fields[position]) for similarity, position in results]
+
+    def lookup(self, key: str, fuzzy: bool = False, minSimilarity: float = 0.5) -> List:
+        """
+        Fields for key: exact key text matches, else normalised key matches, else (if fuzzy) the fields with the
+        best n-gram similarity.
+        """
+        result = self.exact(key)
+        if not result:
+            result = self.normalized(key)
+        if not result and fuzzy:
+            matches = self.fuzzy(key, minSimilarity=minSimilarity)
+            if matches:
+                best = matches[0][0]
+                result = [field for similarity, field in matches if similarity == best]
+        return result
+
+    def lookup_many(self, keys: Iterable[str], fuzzy: bool = False, minSimilarity: float = 0.5) -> Dict[str, List]:
+        """key -> lookup(key) for all keys"""
+        return {key: self.lookup(key, fuzzy=fuzzy, minSimilarity=minSimilarity) for key in keys}
+
+
 class Form:
 
     def __init__(self):
         self._fields = []
         self._fieldsMap = {}
+        self._keyIndex = KeyIndex()
 
     def addField(self, field):
         self._fields.append(field)
         self._fieldsMap[field.key.text] = field
+        self._keyIndex.add(field)
 
     def __str__(self):
         s = ""
@@ -313,16 +466,27 @@ class Form:
             field = self._fieldsMap[key]
         return field
 
+    def getFieldsByKey(self, key):
+        """all fields with this key text (getFieldByKey only returns the last one)"""
+        return self._keyIndex.exact(key)
+
     def searchFieldsByKey(self, key):
-        searchKey = key.lower()
-        results = []
-        for field in self._fields:
-            if (field.key and searchKey in field.key.text.lower()):
-                results.append(field)
-        return results
+        return self._keyIndex.search(key)
+
+    @property
+    def keyIndex(self) -> KeyIndex:
+        return self._keyIndex
+
+    def lookup(self, key, fuzzy=False, minSimilarity=0.5):
+        return self._keyIndex.lookup(key, fuzzy=fuzzy, minSimilarity=minSimilarity)
+
+    def lookup_many(self, keys, fuzzy=False, minSimilarity=0.5):
+        return self._keyIndex.lookup_many(keys, fuzzy=fuzzy, minSimilarity=minSimilarity)
 
 
 class BaseCell(BaseBlock):
+    __slots__ = ('_rowIndex', '_columnIndex', '_rowSpan', '_columnSpan', '_content', '_entityTypes',
+                 '_isChildOfMergedCell')
 
     def __init__(self, block, blockMap):
         super().__init__(block, blockMap)
@@ -361,11 +525,12 @@ class BaseCell(BaseBlock):
 
 
 class Cell(BaseCell):
+    __slots__ = ('_mergedText', '_mergedCellParent')
 
     def __init__(self, block, blockMap):
         super().__init__(block, blockMap)
         self._mergedText = None
-        self._mergedCellParent: MergedCell
+        self._mergedCellParent: Optional[MergedCell] = None
 
         if 'Relationships' in block and block['Relationships']:
             for rs in block['Relationships']:
@@ -373,11 +538,11 @@ class Cell(BaseCell):
                     for cid in rs['Ids']:
                         blockType = blockMap[cid]["BlockType"]
                         if (blockType == "WORD"):
-                            w = Word(blockMap[cid], blockMap)
+                            w = _getBlockObject(blockMap, cid, Word)
                             self._content.append(w)
                             self._text = self._text + w.text + ' '
                         elif (blockType == "SELECTION_ELEMENT"):
-                            se = SelectionElement(blockMap[cid], blockMap)
+                            se = _getBlockObject(blockMap, cid, SelectionElement)
                             self._content.append(se)
                             self._text = self._text + se.selectionStatus + ', '
         if ('EntityTypes' in block and block['EntityTypes']):
@@ -393,8 +558,13 @@ class Cell(BaseCell):
 
 class MergedCell(BaseCell):
 
-    def __init__(self, block, blockMap, rows):
+    def __init__(self, block, blockMap, rows, cellsById=None):
+        """
+        cellsById: cell id -> Cell of the table (see Table). Built from rows if not given.
+        """
         super().__init__(block, blockMap)
+        if cellsById is None:
+            cellsById = {cell.id: cell for row in rows for cell in row.cells}
         self._rowIndex = block['RowIndex']
         self._columnIndex = block['ColumnIndex']
         self._rowSpan = block['RowSpan']
@@ -403,15 +573,16 @@ class MergedCell(BaseCell):
         if 'Relationships' in block and block['Relationships']:
             for rs in block['Relationships']:
                 if rs['Type'] == 'CHILD':
-                    # generate the merged cell text
                     for cid in rs['Ids']:
-                        self.text += Cell(blockMap[cid], blockMap).text
-                    # now find the cell-ids in the current rows and set the _isChildOfMergedCell and _mergedCellParent
-                    for row in rows:
-                        for cell in row.cells:
-                            if cell.id in rs['Ids']:
-                                cell._mergedCellParent = self
-                                cell._isChildOfMergedCell = True
+                        cell = cellsById.get(cid)
+                        if cell is None:
+                            # child cell is not part of the table rows, only use it for the merged cell text
+                            self.text += _getBlockObject(blockMap, cid, Cell).text
+                            continue
+                        # generate the merged cell text and set the _isChildOfMergedCell and _mergedCellParent
+                        self.text += cell.text
+                        cell._mergedCellParent = self
+                        cell._isChildOfMergedCell = True
 
         if ('EntityTypes' in block and block['EntityTypes']):
             self._entityTypes = block['EntityTypes']
@@ -448,23 +619,34 @@ class Table(BaseBlock):
         self._rows: List[Row] = []
         self._merged_cells: List[MergedCell] = []
         self._merged_cells_ids = []
+        # cell id -> Cell and (RowIndex, ColumnIndex) -> Cell, a cell spanning several rows/columns is in all its positions
+        self._cells_by_id: Dict[str, Cell] = dict()
+        self._grid: Dict[Tuple[int, int], Cell] = dict()
         if ('Relationships' in block and block['Relationships']):
             for rs in block['Relationships']:
                 if (rs['Type'] == 'CHILD'):
                     cells: List[Cell] = list()
                     for cid in rs['Ids']:
-                        cell = Cell(blockMap[cid], blockMap)
+                        cell = _getBlockObject(blockMap, cid, Cell)
                         cells.append(cell)
+                        self._cells_by_id[cid] = cell
+                        for row_index in range(cell.rowIndex, cell.rowIndex + max(cell.rowSpan, 1)):
+                            for column_index in range(cell.columnIndex, cell.columnIndex + max(cell.columnSpan, 1)):
+                                self._grid.setdefault((row_index, column_index), cell)
+                    if not cells:
+                        continue
                     cells.sort(key=lambda cell: (cell.rowIndex, cell.columnIndex))
-                    for row_index in range(1, max([x.rowIndex for x in cells]) + 1):
-                        new_row: Row = Row()
-                        new_row.cells = [x for x in cells if x.rowIndex == row_index]
-                        self._rows.append(new_row)
+                    new_rows: List[Row] = [Row() for _ in range(cells[-1].rowIndex)]
+                    for cell in cells:
+                        if cell.rowIndex >= 1:
+                            new_rows[cell.rowIndex - 1].cells.append(cell)
+                    self._rows.extend(new_rows)
                 elif (rs['Type'] == 'MERGED_CELL'):
                     self._merged_cells_ids = rs['Ids']
 
             if len(self._merged_cells_ids) > 0:
                 self._resolve_merged_cells(blockMap)
+        self._partition_header()
 
     def __str__(self):
         s = "Table\n==========\n"
@@ -475,21 +657,70 @@ class Table(BaseBlock):
 
     def _resolve_merged_cells(self, blockMap):
         for cid in self._merged_cells_ids:
-            merged_cell = MergedCell(blockMap[cid], blockMap, self._rows)
+            merged_cell = MergedCell(blockMap[cid], blockMap, self._rows, self._cells_by_id)
             self._merged_cells.append(merged_cell)
 
-    def get_header_field_names(self):
-        header_cells = self.header
-        header_names = []
-        for header in header_cells:
-            s = []
-            for cell in header:
-                if cell._isChildOfMergedCell:
-                    s.append(cell.mergedText.strip())
-                else:
-                    s.append(cell.text.strip())
-            header_names.append(s)
-        return header_names
+    def _partition_header(self):
+        """
+        Split the rows into column-header rows and body rows and compute the header names once.
+        Needs the merged cells resolved first, as header names use the merged cell text.
+        """
+        self._header: List[List[Cell]] = []
+        self._rows_without_header: List[Row] = []
+        for row in self._rows:
+            header_cells = [cell for cell in row.cells if ENTITY_TYPE_COLUMN_HEADER in cell.entityTypes]
+            if header_cells:
+                self._header.append(header_cells)
+            else:
+                self._rows_without_header.append(row)
+        self._header_field_names: List[List[str]] = [[cell.mergedText for cell in header_cells]
+                                                     for header_cells in self._header]
+        # with several header rows, a column name is the texts of its header cells top to bottom,
+        # a merged header cell spanning the header rows is only used once
+        column_header_texts: Dict[int, List[str]] = dict()
+        previous_merged_cell: Dict[int, Optional[MergedCell]] = dict()
+        for header_cells in self._header:
+            for cell in header_cells:
+                texts = column_header_texts.setdefault(cell.columnIndex, [])
+                merged_cell = cell._mergedCellParent if cell._isChildOfMergedCell else None
+                text = cell.mergedText
+                if text and (merged_cell is None or previous_merged_cell.get(cell.columnIndex) is not merged_cell):
+                    texts.append(text)
+                previous_merged_cell[cell.columnIndex] = merged_cell
+        self._column_headers: Dict[int, str] = {
+            column_index: ' '.join(texts)
+            for column_index, texts in sorted(column_header_texts.items())
+        }
+        # keys of to_records: the header name, suffixed with _<ColumnIndex> if several columns have the same name
+        # (e.g. a merged header cell over several columns), the ColumnIndex for columns without a header name
+        name_counts = Counter(self._column_headers.values())
+        self._record_keys: Dict[int, Union[str, int]] = {
+            column_index: (name if name_counts[name] == 1 else f"{name}_{column_index}") if name else column_index
+            for column_index, name in self._column_headers.items()
+        }
+
+    def cell(self, row_index: int, column_index: int) -> Optional[Cell]:
+        """
+        Cell at the Textract (1-based) RowIndex and ColumnIndex, None if there is no cell at that position.
+        """
+        return self._grid.get((row_index, column_index))
+
+    def get_cell_by_id(self, cell_id: str) -> Optional[Cell]:
+        return self._cells_by_id.get(cell_id)
+
+    def get_header_field_names(self) -> List[List[str]]:
+        return self._header_field_names
+
+    def to_records(self) -> List[Dict]:
+        """
+        One dict per body row (rows without column header), keyed by the column header name and with the
+        merged cell text as value. Header names used by several columns get _<ColumnIndex> appended
+        ("Amount_3", "Amount_5"), columns without a header are keyed by their ColumnIndex.
+        """
+        record_keys = self._record_keys
+        return [{record_keys.get(cell.columnIndex, cell.columnIndex): cell.mergedText
+                 for cell in row.cells}
+                for row in self._rows_without_header]
 
     @property
     def rows(self) -> List[Row]:
@@ -497,114 +728,287 @@ class Table(BaseBlock):
 
     @property
     def header(self) -> List[List[Cell]]:
-        header_rows = []
-        for row in self._rows:
-            header_cells: List[Cell] = list()
-            for cell in row.cells:
-                for entity_type in cell.entityTypes:
-                    if entity_type == ENTITY_TYPE_COLUMN_HEADER:
-                        header_cells.append(cell)
-            if (len(header_cells) > 0):
-                header_rows.append(header_cells)
-
-        return header_rows
+        """column header cells per header row, computed when the table is built"""
+        return self._header
 
     @property
     def rows_without_header(self) -> List[Row]:
-        non_header_rows: List[Row] = list()
-        for row in self.rows:
-            header = False
-            for cell in row.cells:
-                for entity_type in cell.entityTypes:
-                    if entity_type == ENTITY_TYPE_COLUMN_HEADER:
-                        header = True
-            if not header:
-                non_header_rows.append(row)
-        return non_header_rows
+        return self._rows_without_header
+
+    @property
+    def column_headers(self) -> Dict[int, str]:
+        """ColumnIndex -> column header name"""
+        return self._column_headers
 
     @property
     def merged_cells(self) -> List[MergedCell]:
         return self._merged_cells
 
 
+class _ReadingOrderCluster:
+    """bounding box and lines of a paragraph or column while computing the reading order"""
+    __slots__ = ('left', 'top', 'right', 'bottom', 'totalLineHeight', 'members')
+
+    def __init__(self, left, top, right, bottom, totalLineHeight, member):
+        self.left = left
+        self.top = top
+        self.right = right
+        self.bottom = bottom
+        self.totalLineHeight = totalLineHeight
+        self.members = [member]
+
+    def add(self, left, top, right, bottom, totalLineHeight, member):
+        self.left = min(self.left, left)
+        self.top = min(self.top, top)
+        self.right = max(self.right, right)
+        self.bottom = max(self.bottom, bottom)
+        self.totalLineHeight = totalLineHeight
+        self.members.append(member)
+
+
+class _ColumnIndex:
+    """
+    columns of the reading order by horizontal position: the x range of the paragraphs is split into about
+    sqrt(number of paragraphs) strips and each column is listed (ascending) in all strips its left to right range
+    touches, so lookups only look at the columns around a box instead of all columns
+    """
+    __slots__ = ('columns', 'xMin', 'scale', 'strips', 'spans')
+
+    def __init__(self, paragraphs, columns):
+        # the list of columns (_ReadingOrderCluster) being built, read by update and overlaps
+        self.columns = columns
+        nStrips = max(1, int(len(paragraphs)**0.5))
+        self.xMin = min((para.left for para in paragraphs), default=0)
+        xMax = max((para.right for para in paragraphs), default=0)
+        self.scale = nStrips / (xMax - self.xMin) if xMax > self.xMin else 0
+        self.strips = [[] for _ in range(nStrips)]
+        # column index -> (first strip, last strip)
+        self.spans = []
+
+    def _strip(self, x):
+        return min(max(int((x - self.xMin) * self.scale), 0), len(self.strips) - 1)
+
+    def update(self, ixColumn):
+        """add a new column or a column that grew. Columns only grow, so the column is only added to strips"""
+        column = self.columns[ixColumn]
+        first, last = self._strip(column.left), self._strip(column.right)
+        if ixColumn == len(self.spans):
+            self.spans.append((first, last))
+            oldFirst, oldLast = last + 1, last
+        else:
+            oldFirst, oldLast = self.spans[ixColumn]
+            self.spans[ixColumn] = (first, last)
+        for ixStrip in range(first, last + 1):
+            if not oldFirst <= ixStrip <= oldLast:
+                insort(self.strips[ixStrip], ixColumn)
+
+    def between(self, left, right):
+        """indexes (ascending) of the columns that may overlap the range left to right"""
+        first, last = self._strip(left), self._strip(right)
+        if first == last:
+            return self.strips[first]
+        return sorted({ixColumn for ixStrip in range(first, last + 1) for ixColumn in self.strips[ixStrip]})
+
+    def overlaps(self, left, top, right, bottom, ixIgnore):
+        """True if a column other than the one at ixIgnore overlaps the box"""
+        columns = self.columns
+        for ixStrip in range(self._strip(left), self._strip(right) + 1):
+            for ixColumn in self.strips[ixStrip]:
+                if ixColumn != ixIgnore:
+                    other = columns[ixColumn]
+                    if min(other.bottom, bottom) > max(other.top, top) and min(other.right, right) > max(
+                            other.left, left):
+                        return True
+        return False
+
+
+def _linesInReadingOrder(lines,
+                         colHOverlapThresh=0.8,
+                         colHMultilineUnionThresh=0.7,
+                         paraVDistTol=0.7,
+                         paraLineHeightTol=0.3):
+    """
+    Heuristic reading order, an approximation of getLineClustersInReadingOrder in the JS parser: lines are
+    grouped into paragraphs, paragraphs into columns, and the result is read column by column. Unlike the JS
+    parser the lines are swept by top coordinate and there is no special handling of outlier line heights.
+    Returns a list of (column index, line).
+
+    Paragraphs are built by sweeping the lines sorted by top coordinate. A paragraph is closed as soon as it is
+    too far above the sweep position to accept any further line, so each line is only compared with the few
+    paragraphs still open at its height instead of all paragraphs of the page. Columns are kept in strips along
+    x (_ColumnIndex): a paragraph is only compared with the columns it overlaps horizontally, and the check
+    that a grown column does not overlap another one only looks at the columns in the same strips.
+    """
+    boxes = []
+    for line in lines:
+        bb = line.geometry.boundingBox
+        boxes.append((bb.left, bb.top, bb.left + bb.width, bb.top + bb.height))
+
+    paragraphs = []
+    openParagraphs = []
+    for ixLine in sorted(range(len(lines)), key=lambda i: boxes[i][1]):
+        left, top, right, bottom = boxes[ixLine]
+        height = bottom - top
+        hCentre = (left + right) / 2
+        if paraLineHeightTol < 1:
+            # with the line height check, the average line height of a paragraph with n lines can grow to
+            # at most totalLineHeight / (n - paraLineHeightTol) by adding a line
+            openParagraphs = [
+                para for para in openParagraphs
+                if top - para.bottom < paraVDistTol * para.totalLineHeight / (len(para.members) - paraLineHeightTol)
+            ]
+        assigned = False
+        for para in openParagraphs:
+            if not ((para.left < hCentre < para.right) or (left < (para.left + para.right) / 2 < right)):
+                continue
+            newTotalLineHeight = para.totalLineHeight + height
+            newAvgLineHeight = newTotalLineHeight / (len(para.members) + 1)
+            vDist = max(0, top - para.bottom, para.top - bottom)
+            if (vDist < newAvgLineHeight * paraVDistTol and newAvgLineHeight > 0
+                    and abs((newAvgLineHeight - height) / newAvgLineHeight) < paraLineHeightTol):
+                para.add(left, top, right, bottom, newTotalLineHeight, ixLine)
+                assigned = True
+                break
+        if not assigned:
+            para = _ReadingOrderCluster(left, top, right, bottom, height, ixLine)
+            paragraphs.append(para)
+            openParagraphs.append(para)
+
+    # back to the order of the Textract response, which is the reading order within a paragraph
+    for para in paragraphs:
+        para.members.sort()
+    paragraphs.sort(key=lambda para: para.members[0])
+
+    columns = []
+    columnIndex = _ColumnIndex(paragraphs, columns)
+    for para in paragraphs:
+        paraLineHeight = para.totalLineHeight / len(para.members)
+        paraWidth = para.right - para.left
+        assigned = False
+        # only columns overlapping the paragraph horizontally can reach colHOverlapThresh
+        candidates = columnIndex.between(para.left, para.right) if colHOverlapThresh > 0 else range(len(columns))
+        for ixColumn in candidates:
+            column = columns[ixColumn]
+            minWidth = min(column.right - column.left, paraWidth)
+            if minWidth <= 0:
+                continue
+            hIsect = max(0, min(column.right, para.right) - max(column.left, para.left))
+            if hIsect / minWidth < colHOverlapThresh:
+                continue
+            vIsect = max(0, min(column.bottom, para.bottom) - max(column.top, para.top))
+            if vIsect >= paraLineHeight * 0.1:
+                continue
+            matchingVsSingleLine = len(para.members) == 1 or (len(column.members) == 1
+                                                               and len(column.members[0].members) == 1)
+            if not matchingVsSingleLine:
+                hUnion = max(column.right, para.right) - min(column.left, para.left)
+                if hIsect / hUnion < colHMultilineUnionThresh:
+                    continue
+            # the extended column must not overlap any other column
+            if columnIndex.overlaps(min(column.left, para.left), min(column.top, para.top),
+                                    max(column.right, para.right), max(column.bottom, para.bottom), ixColumn):
+                continue
+            column.add(para.left, para.top, para.right, para.bottom, 0, para)
+            columnIndex.update(ixColumn)
+            assigned = True
+            break
+        if not assigned:
+            columns.append(_ReadingOrderCluster(para.left, para.top, para.right, para.bottom, 0, para))
+            columnIndex.update(len(columns) - 1)
+
+    return [(ixColumn, lines[ixLine])
+            for ixColumn, column in enumerate(columns)
+            for para in column.members
+            for ixLine in para.members]
+
+
 class Page:
 
-    def __init__(self, blocks, blockMap):
+    def __init__(self, blocks, blockMap, lazy=False):
+        """
+        lazy=True defers building the lines, tables and form of the page until they are first accessed.
+        Each of them is built once and cached.
+        """
         self._blocks = blocks
-        self._text = ""
-        self._lines = []
-        self._form = Form()
-        self._tables = []
-        self._content = []
+        self._blockMap = blockMap
+        self._text = None
+        self._lines = None
+        self._form = None
+        self._tables = None
+        self._content = None
+        self._readingOrder = None
         self._custom = dict()
 
-        self._parse(blockMap)
+        self._parsePageBlock()
+        if not lazy:
+            self._parse(blockMap)
 
     def __str__(self):
         s = "Page\n==========\n"
-        for item in self._content:
+        for item in self.content:
             s = s + str(item) + "\n"
         return s
 
-    def _parse(self, blockMap):
+    def _parsePageBlock(self):
         for item in self._blocks:
             if item["BlockType"] == "PAGE":
                 self._geometry = Geometry(item['Geometry'])
                 self._id = item['Id']
                 if "Custom" in item:
                     self._custom = item["Custom"]
-            elif item["BlockType"] == "LINE":
-                l = Line(item, blockMap)
-                self._lines.append(l)
-                self._content.append(l)
-                self._text = self._text + l.text + '\n'
-            elif item["BlockType"] == "TABLE":
-                t = Table(item, blockMap)
-                self._tables.append(t)
-                self._content.append(t)
-            elif item["BlockType"] == "KEY_VALUE_SET":
-                if 'KEY' in item['EntityTypes']:
-                    f = Field(item, blockMap)
-                    if (f.key):
-                        self._form.addField(f)
-                        self._content.append(f)
-                    else:
-                        logger.info(
-                            f"INFO: Detected K/V where key does not have content. Excluding key from output. {f} - {item}"
-                        )
+                break
 
-    def getLinesInReadingOrder(self):
-        columns = []
-        lines = []
-        for item in self._lines:
-            column_found = False
-            for index, column in enumerate(columns):
-                bbox_left = item.geometry.boundingBox.left
-                bbox_right = item.geometry.boundingBox.left + item.geometry.boundingBox.width
-                bbox_centre = item.geometry.boundingBox.left + item.geometry.boundingBox.width / 2
-                column_centre = column['left'] + column['right'] / 2
-                if (bbox_centre > column['left'] and bbox_centre < column['right']) or (column_centre > bbox_left
-                                                                                        and column_centre < bbox_right):
-                    #Bbox appears inside the column
-                    lines.append([index, item.text])
-                    column_found = True
-                    break
-            if not column_found:
-                columns.append({
-                    'left': item.geometry.boundingBox.left,
-                    'right': item.geometry.boundingBox.left + item.geometry.boundingBox.width
-                })
-                lines.append([len(columns) - 1, item.text])
+    def _parse(self, blockMap):
+        self._parseLines(blockMap)
+        self._parseTables(blockMap)
+        self._parseForm(blockMap)
+        self._parseContent()
 
-        lines.sort(key=lambda x: x[0])
-        return lines
+    def _parseLines(self, blockMap):
+        self._lines = []
+        for item in self._blocks:
+            if item["BlockType"] == "LINE":
+                self._lines.append(_getBlockObject(blockMap, item['Id'], Line))
+        self._text = ''.join(l.text + '\n' for l in self._lines)
+
+    def _parseTables(self, blockMap):
+        self._tables = []
+        for item in self._blocks:
+            if item["BlockType"] == "TABLE":
+                self._tables.append(_getBlockObject(blockMap, item['Id'], Table))
+
+    def _parseForm(self, blockMap):
+        self._form = Form()
+        for item in self._blocks:
+            if item["BlockType"] == "KEY_VALUE_SET" and 'KEY' in item['EntityTypes']:
+                f = Field(item, blockMap)
+                if (f.key):
+                    self._form.addField(f)
+                else:
+                    logger.info(
+                        f"INFO: Detected K/V where key does not have content. Excluding key from output. {f} - {item}")
+
+    def _parseContent(self):
+        # content keeps the order of the blocks on the page, so interleave the already built objects by block id
+        itemsById = {}
+        for item in self.lines:
+            itemsById[item.id] = item
+        for item in self.tables:
+            itemsById[item.id] = item
+        for item in self.form.fields:
+            itemsById[item.id] = item
+        self._content = [itemsById[item['Id']] for item in self._blocks if item['Id'] in itemsById]
+
+    def getLinesInReadingOrder(self):
+        """
+        [column index, line text] for all lines of the page in reading order. Computed once per page.
+        """
+        if self._readingOrder is None:
+            self._readingOrder = [[columnIndex, line.text] for columnIndex, line in _linesInReadingOrder(self.lines)]
+        return self._readingOrder
 
     def getTextInReadingOrder(self):
-        lines = self.getLinesInReadingOrder()
-        text = ""
-        for line in lines:
-            text = text + line[1] + '\n'
-        return text
+        return ''.join(line[1] + '\n' for line in self.getLinesInReadingOrder())
 
     @property
     def blocks(self):
@@ -612,22 +1016,32 @@ class Page:
 
     @property
     def text(self):
+        if self._text is None:
+            self._parseLines(self._blockMap)
         return self._text
 
     @property
     def lines(self):
+        if self._lines is None:
+            self._parseLines(self._blockMap)
         return self._lines
 
     @property
     def form(self):
+        if self._form is None:
+            self._parseForm(self._blockMap)
         return self._form
 
     @property
     def tables(self):
+        if self._tables is None:
+            self._parseTables(self._blockMap)
         return self._tables
 
     @property
     def content(self):
+        if self._content is None:
+            self._parseContent()
         return self._content
 
     @property
@@ -645,7 +1059,11 @@ class Page:
 
 class Document:
 
-    def __init__(self, responsePages):
+    def __init__(self, responsePages, lazy=False):
+        """
+        lazy=True only splits the response into pages up front. Each page builds its lines, tables
+        and form on first access, so the cost scales with the parts of the document actually used.
+        """
 
         if (not isinstance(responsePages, list)):
             rps = []
@@ -654,6 +1072,8 @@ class Document:
 
         self._responsePages = responsePages
         self._pages = []
+        self._lazy = lazy
+        self._keyIndex = None
 
         self._parse()
 
@@ -665,7 +1085,7 @@ class Document:
 
     def _parseDocumentPagesAndBlockMap(self):
 
-        blockMap = {}
+        blockMap = BlockMap()
 
         documentPages = []
         documentPage = None
@@ -692,7 +1112,7 @@ class Document:
 
         self._responseDocumentPages, self._blockMap = self._parseDocumentPagesAndBlockMap()
         for documentPage in self._responseDocumentPages:
-            page = Page(documentPage["Blocks"], self._blockMap)
+            page = Page(documentPage["Blocks"], self._blockMap, lazy=self._lazy)
             self._pages.append(page)
 
     @property
@@ -707,8 +1127,59 @@ class Document:
     def pages(self):
         return self._pages
 
+    @property
+    def keyIndex(self) -> KeyIndex:
+        """KeyIndex over the form fields of all pages, built on first access"""
+        if self._keyIndex is None:
+            self._keyIndex = KeyIndex(field for page in self._pages for field in page.form.fields)
+        return self._keyIndex
+
+    def lookup_many(self, keys, fuzzy=False, minSimilarity=0.5):
+        return self.keyIndex.lookup_many(keys, fuzzy=fuzzy, minSimilarity=minSimilarity)
+
     def getBlockById(self, blockId):
         block = None
         if (self._blockMap and blockId in self._blockMap):
             block = self._blockMap[blockId]
         return block
+
+
+def _pageBlocksArrived(pageBlocks, blockMap):
+    for block in pageBlocks:
+        for rs in block.get('Relationships') or []:
+            for cid in rs['Ids']:
+                if cid not in blockMap:
+                    return False
+    return True
+
+
+def iterPages(responsePages, lazy=False):
+    """
+    Yield the pages of a Textract result from an iterable of response chunks (e.g. the GetDocumentAnalysis
+    NextToken responses or the numbered output files of an async job), without loading all chunks first.
+
+    A page is yielded once the next PAGE block has been read and all blocks referenced by its blocks have
+    arrived, so processing of the first pages can start while later chunks are still read.
+    All pages share one BlockMap, lazy is passed on to Page.
+    """
+    if isinstance(responsePages, dict):
+        responsePages = [responsePages]
+    blockMap = BlockMap()
+    pendingPages = deque()
+    documentPage = None
+    for responsePage in responsePages:
+        for block in responsePage['Blocks']:
+            if ('BlockType' in block and 'Id' in block):
+                blockMap[block['Id']] = block
+            if (block['BlockType'] == 'PAGE'):
+                documentPage = [block]
+                pendingPages.append(documentPage)
+            elif documentPage:
+                documentPage.append(block)
+            else:
+                logger.error("assumed documentPage not None, but was None")
+        # all but the last pending page are closed by a later PAGE block
+        while len(pendingPages) > 1 and _pageBlocksArrived(pendingPages[0], blockMap):
+            yield Page(pendingPages.popleft(), blockMap, lazy=lazy)
+    while pendingPages:
+        yield Page(pendingPages.popleft(), blockMap, lazy=lazy)
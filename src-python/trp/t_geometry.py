@@ -0,0 +1,243 @@
+"""
+Columnar geometry for TDocument blocks, based on NumPy.
+
+TGeometryStore copies the bounding boxes and polygons of a list of blocks into NumPy arrays and replaces
+the TBoundingBox and TPoint objects of the blocks with views on these arrays. Reading and writing
+block.geometry works as before, while operations on many blocks (scaling, sorting, filtering, overlap
+tests) run on the arrays in one step.
+
+NumPy is an optional dependency: python -m pip install numpy
+"""
+from __future__ import annotations
+import math
+from typing import Dict, Iterable, List, Optional
+from trp.trp2 import TBlock, TBoundingBox, TPoint, cos_sin_for_degrees
+
+try:
+    import numpy as np
+except ImportError:    # pragma: no cover
+    np = None
+
+# columns of TGeometryStore.boxes, same order as TBoundingBox.to_list()
+WIDTH, HEIGHT, LEFT, TOP = range(4)
+
+
+def _to_float(value) -> float:
+    return math.nan if value is None else float(value)
+
+
+def _from_float(value) -> Optional[float]:
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class TBoundingBoxView(TBoundingBox):
+    """TBoundingBox reading from and writing to one row of TGeometryStore.boxes"""
+
+    def __init__(self, boxes, row: int) -> None:
+        self._boxes = boxes
+        self._row = row
+
+    def _get(self, column: int) -> Optional[float]:
+        return _from_float(self._boxes[self._row, column])
+
+    def _set(self, column: int, value):
+        self._boxes[self._row, column] = _to_float(value)
+
+    width = property(lambda self: self._get(WIDTH), lambda self, value: self._set(WIDTH, value))
+    height = property(lambda self: self._get(HEIGHT), lambda self, value: self._set(HEIGHT, value))
+    left = property(lambda self: self._get(LEFT), lambda self, value: self._set(LEFT, value))
+    top = property(lambda self: self._get(TOP), lambda self, value: self._set(TOP, value))
+
+    def __eq__(self, o: object) -> bool:
+        if isinstance(o, TBoundingBox):
+            return (self.width, self.height, self.left, self.top) == (o.width, o.height, o.left, o.top)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash((self.width, self.height, self.left, self.top))
+
+
+class TPointView(TPoint):
+    """TPoint reading from and writing to one row of TGeometryStore.points"""
+
+    def __init__(self, points, row: int) -> None:
+        self._points = points
+        self._row = row
+
+    x = property(lambda self: _from_float(self._points[self._row, 0]),
+                 lambda self, value: self._points.__setitem__((self._row, 0), _to_float(value)))
+    y = property(lambda self: _from_float(self._points[self._row, 1]),
+                 lambda self, value: self._points.__setitem__((self._row, 1), _to_float(value)))
+
+    def __eq__(self, o: object) -> bool:
+        if isinstance(o, TPoint):
+            return (self.x, self.y) == (o.x, o.y)
+        return NotImplemented
+
+
+class TGeometryStore():
+    """
+    Geometry of blocks as arrays: boxes is (N, 4) with the columns WIDTH, HEIGHT, LEFT, TOP for the block in
+    row N, points is (M, 2) with the x and y of all polygon points. The polygon of the block in row i is
+    points[polygon_offsets[i]:polygon_offsets[i + 1]]. Missing values are NaN.
+
+    Usage
+    -----
+    store = t_document.geometry_store()
+    rows = store.rows_for(t_document.relationships_recursive(page))
+    rows = store.order(rows, by=TOP)
+    blocks = store.blocks_for(rows[store.overlapping(rows, left=0, top=0, width=1, height=0.1)])
+    """
+
+    def __init__(self, blocks: Iterable[TBlock]):
+        if np is None:
+            raise ImportError("TGeometryStore requires numpy: python -m pip install numpy")
+        self.blocks: List[TBlock] = list(blocks)
+        # number of scale, ratio and rotate calls, lets indexes built on the geometry notice a change
+        self.changes = 0
+        self.row_by_id: Dict[str, int] = {block.id: row for row, block in enumerate(self.blocks)}
+        polygon_lengths = [
+            len(block.geometry.polygon) if block.geometry and block.geometry.polygon else 0 for block in self.blocks
+        ]
+        self.polygon_offsets = np.zeros(len(self.blocks) + 1, dtype=np.int64)
+        np.cumsum(polygon_lengths, out=self.polygon_offsets[1:])
+        self.boxes = np.full((len(self.blocks), 4), np.nan)
+        self.points = np.full((int(self.polygon_offsets[-1]), 2), np.nan)
+        # row of the block for each point
+        self.point_rows = np.repeat(np.arange(len(self.blocks)), polygon_lengths)
+        for row, block in enumerate(self.blocks):
+            geometry = block.geometry
+            if not geometry:
+                continue
+            bounding_box = geometry.bounding_box
+            if bounding_box is not None:
+                self.boxes[row] = [
+                    _to_float(bounding_box.width),
+                    _to_float(bounding_box.height),
+                    _to_float(bounding_box.left),
+                    _to_float(bounding_box.top)
+                ]
+                geometry.bounding_box = TBoundingBoxView(self.boxes, row)
+            if geometry.polygon:
+                start = int(self.polygon_offsets[row])
+                self.points[start:start + len(geometry.polygon)] = [[_to_float(p.x), _to_float(p.y)]
+                                                                    for p in geometry.polygon]
+                geometry.polygon = [TPointView(self.points, start + idx) for idx in range(len(geometry.polygon))]
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def rows_for(self, blocks: Iterable[TBlock]):
+        """rows of the blocks in the store (blocks not in the store are skipped)"""
+        return np.array([self.row_by_id[b.id] for b in blocks if b.id in self.row_by_id], dtype=np.int64)
+
+    def blocks_for(self, rows) -> List[TBlock]:
+        return [self.blocks[row] for row in rows]
+
+    def polygon(self, row: int):
+        """(k, 2) view on the polygon points of the block in the row"""
+        return self.points[self.polygon_offsets[row]:self.polygon_offsets[row + 1]]
+
+    def _all_rows(self, rows):
+        return np.arange(len(self.blocks)) if rows is None else np.asarray(rows, dtype=np.int64)
+
+    def _point_mask(self, rows):
+        if rows is None:
+            return slice(None)
+        return np.isin(self.point_rows, rows)
+
+    @property
+    def right(self):
+        return self.boxes[:, LEFT] + self.boxes[:, WIDTH]
+
+    @property
+    def bottom(self):
+        return self.boxes[:, TOP] + self.boxes[:, HEIGHT]
+
+    def scale(self, doc_width: float, doc_height: float, rows=None):
+        """same as TGeometry.scale for the blocks in rows (default all)"""
+        self.changes += 1
+        factors = np.array([doc_width, doc_height, doc_width, doc_height], dtype=float)
+        if rows is None:
+            self.boxes *= factors
+        else:
+            self.boxes[rows] *= factors
+        self.points[self._point_mask(rows)] *= np.array([doc_width, doc_height], dtype=float)
+
+    def ratio(self, doc_width: float, doc_height: float, rows=None):
+        """same as TGeometry.ratio for the blocks in rows (default all)"""
+        self.changes += 1
+        factors = np.array([doc_width, doc_height, doc_width, doc_height], dtype=float)
+        if rows is None:
+            self.boxes /= factors
+        else:
+            self.boxes[rows] /= factors
+        self.points[self._point_mask(rows)] /= np.array([doc_width, doc_height], dtype=float)
+
+    def rotate(self, degrees: float, origin_x: float = 0.5, origin_y: float = 0.5, rows=None):
+        """same as TGeometry.rotate for the blocks in rows (default all)"""
+        cos_result, sin_result = cos_sin_for_degrees(degrees)
+        self.rotate_with(cos_result, sin_result, origin_x, origin_y, rows=rows)
+
+    def rotate_with(self, cos_result: float, sin_result: float, origin_x: float, origin_y: float, rows=None):
+        """
+        rotate the boxes and polygons of the blocks in rows (default all) with the cos and sin of the angle
+        already computed (see trp2.cos_sin_for_degrees). Coordinates are kept between 0 and 1 like TPoint.rotate,
+        a rotated box is the smallest box containing its rotated corners like TBoundingBox.rotate.
+        """
+        self.changes += 1
+        box_rows = slice(None) if rows is None else rows
+        boxes = self.boxes[box_rows]
+        right = boxes[:, LEFT] + boxes[:, WIDTH]
+        bottom = boxes[:, TOP] + boxes[:, HEIGHT]
+        # the corners in the same order as TBoundingBox.rotate, shape (n, 4)
+        corners_x = np.stack([boxes[:, LEFT], right, boxes[:, LEFT], right], axis=1)
+        corners_y = np.stack([boxes[:, TOP], boxes[:, TOP], bottom, bottom], axis=1)
+        corners_x, corners_y = _rotate_xy(corners_x, corners_y, origin_x, origin_y, cos_result, sin_result)
+        xmin = corners_x.min(axis=1)
+        ymin = corners_y.min(axis=1)
+        boxes[:, WIDTH] = corners_x.max(axis=1) - xmin
+        boxes[:, HEIGHT] = corners_y.max(axis=1) - ymin
+        boxes[:, LEFT] = xmin
+        boxes[:, TOP] = ymin
+        self.boxes[box_rows] = boxes
+
+        point_mask = self._point_mask(rows)
+        points = self.points[point_mask]
+        points[:, 0], points[:, 1] = _rotate_xy(points[:, 0], points[:, 1], origin_x, origin_y, cos_result,
+                                                sin_result)
+        self.points[point_mask] = points
+
+    def polygon_angles(self, rows=None):
+        """
+        orientation in degrees (-180.0 < x <= 180.0) of the first polygon edge for the blocks in rows (default all),
+        NaN for blocks with less than 2 polygon points
+        """
+        rows = self._all_rows(rows)
+        starts = self.polygon_offsets[rows]
+        has_edge = self.polygon_offsets[rows + 1] - starts >= 2
+        angles = np.full(len(rows), np.nan)
+        point_0 = self.points[starts[has_edge]]
+        point_1 = self.points[starts[has_edge] + 1]
+        angles[has_edge] = np.degrees(np.arctan2(point_1[:, 1] - point_0[:, 1], point_1[:, 0] - point_0[:, 0]))
+        return angles
+
+    def order(self, rows=None, by: int = TOP):
+        """rows (default all) sorted by a boxes column (stable, missing values last)"""
+        rows = self._all_rows(rows)
+        return rows[np.argsort(self.boxes[rows, by], kind="stable")]
+
+    def overlapping(self, rows=None, left: float = 0, top: float = 0, width: float = 1, height: float = 1):
+        """boolean mask over rows (default all) of the boxes that overlap the given box"""
+        rows = self._all_rows(rows)
+        boxes = self.boxes[rows]
+        return ((boxes[:, LEFT] < left + width) & (boxes[:, LEFT] + boxes[:, WIDTH] > left)
+                & (boxes[:, TOP] < top + height) & (boxes[:, TOP] + boxes[:, HEIGHT] > top))
+
+
+def _rotate_xy(x, y, origin_x: float, origin_y: float, cos_result: float, sin_result: float):
+    """trp2._rotate_xy on arrays, keeping the coordinates between 0 and 1"""
+    new_x = origin_x + cos_result * (x - origin_x) - sin_result * (y - origin_y)
+    new_y = origin_y + sin_result * (x - origin_x) + cos_result * (y - origin_y)
+    return np.clip(new_x, 0, 1), np.clip(new_y, 0, 1)
@@ -1,7 +1,10 @@
 import logging
 from trp.t_tables import ExecuteTableValidations, MergeOptions, HeaderFooterType
 import trp.trp2 as t2
-from typing import List, Callable
+from typing import List, Callable, Dict, Optional
+from collections import Counter
+import heapq
+from dataclasses import dataclass, field
 import math
 import statistics
 
@@ -11,102 +14,183 @@ def order_blocks_by_geo(t_document: t2.TDocument) -> t2.TDocument:
     # TODO: add ordering of pages by pagenumber
     """
     takes in a Textract JSON response and outputs a Textract JSON response schema which has the elements sorted by geometry (top coordinate of bounding box)
+    t_document.blocks is not changed, the order is recorded per page with TDocument.set_reading_order and applied when
+    the document is serialized (to_dict, to_json, TDocumentSchema().dump) or read with blocks_in_reading_order()
     """
-    new_order: List[t2.TBlock] = list()
     for page in t_document.pages:
-        new_order.append(page)
         r = t_document.relationships_recursive(page)
         page_relationships = list(r) if r else list()
         page_blocks = sorted(page_relationships,
                              key=lambda b: b.geometry.bounding_box.top
                              if not b.text_type == "PAGE" and b.geometry and b.geometry.bounding_box else 1)
-        new_order.extend(page_blocks)
-    t_document.blocks = new_order
-    t_document.__post_init__()
+        t_document.set_reading_order(page, page_blocks)
     return t_document
 
-def order_blocks_by_geo_x_y(t_document: t2.TDocument) -> t2.TDocument:
+def _order_blocks_in_rows(blocks: List[t2.TBlock]) -> List[t2.TBlock]:
+    """
+    Groups the blocks into virtual rows and returns them row by row (top to bottom), each row left to right.
+    A block joins the first row (in order of creation) with the same block_type (and entity_types, if the row has
+    them) when the centre of the block is inside the row's first block or the other way round.
+    The blocks are swept top to bottom and rows ending above the current block are dropped from the candidates,
+    so each block is only compared with the rows at its own height.
+    Blocks without a bounding box follow the rows in their original order.
+    """
+    with_box = [b for b in blocks if b.geometry and b.geometry.bounding_box]
+    without_box = [b for b in blocks if not (b.geometry and b.geometry.bounding_box)]
+    # row: [top, bottom, centre, entity_types, blocks, open] with the first block's values
+    rows: List[list] = list()
+    open_rows: Dict[str, List[list]] = dict()
+    open_count: Dict[str, int] = dict()
+    # (bottom, creation index, row) to close rows once the sweep passes their bottom
+    by_bottom: List[tuple] = list()
+    for rounded_top, b in sorted(((round(b.geometry.bounding_box.top, 3), b) for b in with_box),
+                                 key=lambda item: item[0]):
+        bbox = b.geometry.bounding_box
+        bbox_top = bbox.top
+        bbox_bottom = bbox.top + bbox.height
+        bbox_centre = bbox.top + bbox.height / 2
+        # a row can only take a block that starts above the row's bottom. The blocks are sorted by top rounded to
+        # 3 digits, so the top of any later block is at least rounded_top - 0.0005
+        while by_bottom and by_bottom[0][0] <= rounded_top - 0.001:
+            row = heapq.heappop(by_bottom)[2]
+            row[5] = False
+            open_count[row[4][0].block_type] -= 1
+        candidates = open_rows.setdefault(b.block_type, list())
+        if len(candidates) > 2 * open_count.get(b.block_type, 0) + 8:
+            candidates[:] = [row for row in candidates if row[5]]
+        for row in candidates:
+            if not row[5]:
+                continue
+            if row[3] is not None and row[3] != b.entity_types:
+                continue
+            if ((bbox_centre > row[0] and bbox_centre < row[1]) or (row[2] > bbox_top and row[2] < bbox_bottom)):
+                row[4].append(b)
+                break
+        else:
+            row = [bbox_top, bbox_bottom, bbox_centre, b.entity_types, [b], True]
+            heapq.heappush(by_bottom, (bbox_bottom, len(rows), row))
+            rows.append(row)
+            candidates.append(row)
+            open_count[b.block_type] = open_count.get(b.block_type, 0) + 1
+    ordered: List[t2.TBlock] = list()
+    for row in sorted(rows, key=lambda row: float(row[0])):
+        ordered.extend(sorted(row[4], key=lambda b: b.geometry.bounding_box.left))
+    ordered.extend(without_box)
+    return ordered
+
+
+def order_blocks_by_geo_x_y(t_document: t2.TDocument, lines_only: bool = False) -> t2.TDocument:
     """
     Takes in a Textract JSON response and outputs a Textract JSON response schema which has the elements sorted by geometry x (left coordinate) and y-axis (top coordinate)
+    lines_only: cluster only the LINE blocks (and all non WORD blocks) into rows, each LINE is followed by its WORD
+    children in their original order
+    Like order_blocks_by_geo, the order is recorded with TDocument.set_reading_order and t_document.blocks is not
+    changed
     """
-    new_order: List[t2.TBlock] = list()
     for page in t_document.pages:
-        new_order.append(page)
         r = t_document.relationships_recursive(page)
-        rows = list()
         page_relationships = list(r) if r else list()
-        # Sort all blocks by y-axis
-        page_blocks_top = sorted(page_relationships,
-                             key=lambda b: round(b.geometry.bounding_box.top, 3)
-                             if not b.block_type == "PAGE" and b.geometry and b.geometry.bounding_box else 1)
-        for b in page_blocks_top:
-            # Check to see if current block is in existing virtual row
-            row_found = False
-            bbox_top = b.geometry.bounding_box.top
-            bbox_bottom = b.geometry.bounding_box.top + b.geometry.bounding_box.height
-            bbox_centre = b.geometry.bounding_box.top + b.geometry.bounding_box.height/2
-            for row_list in rows:
-                row = row_list[1]
-                if row.block_type != b.block_type:
-                    continue
-                if row.entity_types is not None and row.entity_types != b.entity_types:
+        words_of_line: Dict[str, List[t2.TBlock]] = dict()
+        if lines_only:
+            page_ids = {b.id for b in page_relationships}
+            carried = set()
+            for line in page_relationships:
+                if line.block_type != t2.TextractBlockTypes.LINE.name:
                     continue
-                row_top = row.geometry.bounding_box.top
-                row_bottom = row.geometry.bounding_box.top + row.geometry.bounding_box.height
-                row_centre = row.geometry.bounding_box.top + row.geometry.bounding_box.height/2
-                if((bbox_centre > row_top and bbox_centre < row_bottom) or (row_centre > bbox_top and row_centre < bbox_bottom)):
-                    row_list.append(b)
-                    row_found = True
-                    break
-            # Create a new virtual row if block was not placed in existing virtual rows
-            if(row_found is False):
-                rows.append([bbox_top, b])
-        # sort rows by y-axis
-        rows_ordered_top = sorted(rows,
-                     key=lambda b: float(b[0]))
-        # Order each row by x-axis and flatten
-        page_blocks_ordered = list()
-        for row_list in rows_ordered_top:
-            row_list.pop(0)
-            row_list_left = sorted(row_list,
-                                 key=lambda b: b.geometry.bounding_box.left
-                                 if not b.block_type == "PAGE" and b.geometry and b.geometry.bounding_box else 1)
-            page_blocks_ordered.extend(row_list_left)
-        new_order.extend(page_blocks_ordered)
-    t_document.blocks = new_order
-    t_document.__post_init__()
+                words = [
+                    w for w in t_document.get_blocks_for_relationships(line.get_relationships_for_type())
+                    if w.block_type == t2.TextractBlockTypes.WORD.name and w.id in page_ids and w.id not in carried
+                ]
+                carried.update(w.id for w in words)
+                words_of_line[line.id] = words
+            page_relationships = [b for b in page_relationships if b.id not in carried]
+        page_order: List[t2.TBlock] = list()
+        for b in _order_blocks_in_rows(page_relationships):
+            page_order.append(b)
+            page_order.extend(words_of_line.get(b.id, []))
+        t_document.set_reading_order(page, page_order)
     return t_document
 
-def add_kv_ocr_confidence(t_document: t2.TDocument) -> t2.TDocument:
+def _percentile(sorted_values: List[float], percentile: float) -> float:
+    """percentile (0 to 100) of sorted values, linear interpolation between the closest ranks like numpy.percentile"""
+    position = (len(sorted_values) - 1) * percentile / 100
+    lower = math.floor(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def _kv_related_ids(t_document: t2.TDocument) -> Dict[str, List[str]]:
+    """
+    index KEY_VALUE_SET id -> ids of the blocks related to it, built in one pass over the KEY_VALUE_SET blocks:
+    its CHILD blocks (WORD, SELECTION_ELEMENT), and for a KEY also its VALUE blocks and their CHILD blocks, which
+    are taken from the VALUE's entry instead of walking the VALUE again. These are the blocks of
+    t_document.get_child_relations(key_value_block). Only KEY_VALUE_SET blocks on a page get an entry.
+    """
+    own_ids: Dict[str, List[str]] = dict()
+    value_ids: Dict[str, List[str]] = dict()
+    for key_value_block in t_document.forms():
+        ids: List[str] = list()
+        for relationship in key_value_block.relationships or []:
+            if relationship.type == "VALUE":
+                value_ids.setdefault(key_value_block.id, list()).extend(relationship.ids or [])
+            else:
+                ids.extend(relationship.ids or [])
+        own_ids[key_value_block.id] = ids
+    related_ids: Dict[str, List[str]] = dict()
+    for page in t_document.pages:
+        for key_value_block in t_document.forms(page=page):
+            ids = list(own_ids[key_value_block.id])
+            for value_id in value_ids.get(key_value_block.id, []):
+                ids.append(value_id)
+                ids.extend(own_ids.get(value_id, []))
+            # each block once, like get_child_relations
+            related_ids[key_value_block.id] = list(dict.fromkeys(ids))
+    return related_ids
+
+
+def kv_ocr_confidence(t_document: t2.TDocument, percentile: float = 10) -> Dict[str, Dict[str, float]]:
+    """
+    computes the OCR confidence statistics of all KEY_VALUE_SET blocks at once, from the confidence of the blocks
+    related to each of them (for a KEY this includes its VALUE and the VALUE's words, see _kv_related_ids).
+    Returns KEY_VALUE_SET id -> {'mean': .., 'min': .., 'max': .., 'p10': ..} with the key of the percentile
+    formatted as f"p{percentile:g}". KEY_VALUE_SET blocks without related confidence are left out.
+    """
+    percentile_key = f"p{percentile:g}"
+    confidence_by_id: Dict[str, Optional[float]] = dict()
+    result: Dict[str, Dict[str, float]] = dict()
+    for key_value_id, ids in _kv_related_ids(t_document).items():
+        confidences: List[float] = list()
+        for id in ids:
+            if id not in confidence_by_id:
+                confidence = t_document.get_block_by_id(id).confidence
+                confidence_by_id[id] = float(confidence) if confidence else None
+            if confidence_by_id[id] is not None:
+                confidences.append(confidence_by_id[id])    #type: ignore
+        if confidences:
+            confidences.sort()
+            result[key_value_id] = {
+                'mean': statistics.mean(confidences),
+                'min': confidences[0],
+                'max': confidences[-1],
+                percentile_key: _percentile(confidences, percentile)
+            }
+    return result
+
+
+def add_kv_ocr_confidence(t_document: t2.TDocument, percentile: float = 10) -> t2.TDocument:
     """
-    adds custom attribute to each KEY_VALUE_SET in the form of "Custom":{"OCRConfidence": {'mean': 98.2, 'min': 95.1}}
+    adds custom attribute to each KEY_VALUE_SET in the form of "Custom":{"OCRConfidence": {'mean': 98.2, 'min': 95.1, 'max': 99.8, 'p10': 96.0}}
     If no CHILD relationships exist for a KEY or VALUE, no confidence score will be added.
+    See kv_ocr_confidence for the statistics.
     """
-    for idx, page_block in enumerate(t_document.pages):
-        logger.debug(f"page: {idx}")
-        key_value_blocks = t_document.forms(page=page_block)
-        logger.debug(f"len(key_value_blocks): {len(key_value_blocks)}")
-        for key_value_block in key_value_blocks:
-            logger.debug(f"key_value_block.id: {key_value_block.id}")
-            ocr_blocks = t_document.get_child_relations(key_value_block)
-            if ocr_blocks:
-                logger.debug(f"len(child-relations: {len(ocr_blocks)}")
-                confidence_list: List[float] = [float(x.confidence) for x in ocr_blocks if x.confidence]
-                if confidence_list:
-                    kv_block_ocr_confidence_mean = statistics.mean(confidence_list)
-                    kv_block_ocr_confidence_min = min(confidence_list)
-                    if key_value_block.custom:
-                        key_value_block.custom['OCRConfidence'] = {
-                            'mean': kv_block_ocr_confidence_mean,
-                            'min': kv_block_ocr_confidence_min
-                        }
-                    else:
-                        key_value_block.custom = {
-                            'OCRConfidence': {
-                                'mean': kv_block_ocr_confidence_mean,
-                                'min': kv_block_ocr_confidence_min
-                            }
-                        }
+    confidence_by_id = kv_ocr_confidence(t_document, percentile=percentile)
+    logger.debug("add_kv_ocr_confidence: %s KEY_VALUE_SET blocks", len(confidence_by_id))
+    for key_value_id, ocr_confidence in confidence_by_id.items():
+        key_value_block = t_document.get_block_by_id(key_value_id)
+        if key_value_block.custom:
+            key_value_block.custom['OCRConfidence'] = ocr_confidence
+        else:
+            key_value_block.custom = {'OCRConfidence': ocr_confidence}
     return t_document
 
 
@@ -121,16 +205,64 @@ def __get_degree_from_polygon(poly: List[t2.TPoint] = None) -> float:
     orientation = math.degrees(math.atan2(point_1.y - point_0.y, point_1.x - point_0.x))
     return orientation
 
+
+def _polygon_angles(t_document: t2.TDocument, blocks: List[t2.TBlock]) -> List[float]:
+    """
+    orientation in degrees (-180.0 < x <= 180.0) of the first polygon edge for all blocks, in one pass.
+    Uses the NumPy arrays of the geometry store if the document has one and all blocks are in it.
+    Blocks need a polygon.
+    """
+    if t_document.has_geometry_store():
+        store = t_document.geometry_store()
+        rows = store.rows_for(blocks)
+        # rows_for skips blocks not in the store (e.g. added later), the angles would not match the blocks
+        if len(rows) == len(blocks):
+            return store.polygon_angles(rows).tolist()
+    atan2 = math.atan2
+    degrees = math.degrees
+    angles: List[float] = list()
+    for b in blocks:
+        point_0, point_1 = b.geometry.polygon[0], b.geometry.polygon[1]
+        angles.append(degrees(atan2(point_1.y - point_0.y, point_1.x - point_0.x)))
+    return angles
+
+
+@dataclass
+class TPageOrientation():
+    """
+    orientation of a page based on its WORD and LINE blocks
+    histogram: number of blocks per orientation (rounded to full degrees), in the order first seen
+    mode: the most common orientation (the first seen for ties, like statistics.mode), 0 without blocks
+    confidence: share of the blocks with the mode orientation, 0.0 without blocks
+    """
+    histogram: Dict[int, int] = field(default_factory=dict)
+    mode: int = 0
+    confidence: float = 0.0
+
+
+def page_orientation(t_document: t2.TDocument, page: t2.TBlock) -> TPageOrientation:
+    """computes the orientation histogram, mode and confidence of the WORD and LINE blocks of a page in one pass"""
+    block_types = (t2.TextractBlockTypes.WORD.name, t2.TextractBlockTypes.LINE.name)
+    blocks = [
+        b for b in t_document.get_child_relations(page=page)
+        if b.block_type in block_types and b.geometry and b.geometry.polygon
+    ]
+    histogram: Dict[int, int] = dict(Counter(round(angle) for angle in _polygon_angles(t_document, blocks)))
+    if not histogram:
+        return TPageOrientation()
+    mode = max(histogram, key=histogram.__getitem__)
+    return TPageOrientation(histogram=histogram, mode=mode, confidence=histogram[mode] / len(blocks))
+
+
 def add_orientation_to_blocks(t_document: t2.TDocument) -> t2.TDocument:
     """adds orientation as Custom attribute to all blocks """
     logger.debug("add_orientation")
-    for block in t_document.blocks:
-        if block and block.geometry and block.geometry.polygon:
-            orientation = __get_degree_from_polygon(block.geometry.polygon)
-            if block.custom:
-                block.custom['Orientation'] = orientation
-            else:
-                block.custom = {'Orientation': orientation}
+    blocks = [block for block in t_document.blocks if block and block.geometry and block.geometry.polygon]
+    for block, orientation in zip(blocks, _polygon_angles(t_document, blocks)):
+        if block.custom:
+            block.custom['Orientation'] = orientation
+        else:
+            block.custom = {'Orientation': orientation}
     return t_document
 
 def add_page_orientation(t_document: t2.TDocument) -> t2.TDocument:
@@ -138,15 +270,7 @@ def add_page_orientation(t_document: t2.TDocument) -> t2.TDocument:
        is available in trp as """
     logger.debug("add_page_orientation")
     for page in t_document.pages:
-        words = t2.TDocument.filter_blocks_by_type(
-            block_list=t_document.get_child_relations(page=page),
-            textract_block_type=[t2.TextractBlockTypes.WORD, t2.TextractBlockTypes.LINE])
-        word_orientations = [
-            round(__get_degree_from_polygon(w.geometry.polygon))
-            for w in words if w.geometry and w.geometry.polygon
-        ]
-        # (statistics.mode throws StatisticsError for empty lists)
-        orientation = statistics.mode(word_orientations) if word_orientations else 0
+        orientation = page_orientation(t_document, page).mode
         if page.custom:
             page.custom['PageOrientationBasedOnWords'] = orientation
         else:
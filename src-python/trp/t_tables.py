@@ -2,8 +2,7 @@ import logging
 import trp.trp2 as t2
 from typing import List
 from enum import Enum, auto
-from trp.trp2 import TDocument, TDocumentSchema
-import trp
+from trp.trp2 import TDocument, TBlock, TextractBlockTypes
 
 
 class MergeOptions(Enum):
@@ -20,40 +19,64 @@ class HeaderFooterType(Enum):
 logger = logging.getLogger(__name__)
 
 
-def __validate_objects_between_tables(page1, page1_table, page2, page2_table, header_footer_type: HeaderFooterType):
+def __validate_objects_between_tables(t_doc: TDocument, page1: TBlock, page1_table: TBlock, page2: TBlock,
+                                      page2_table: TBlock, header_footer_type: HeaderFooterType):
     """
     Step 1: Check if there is any lines between the first and second table except in the Footer and Header area
     """
     header_footer_height = header_footer_type.value / 11
     # Validate table 1 with first page footer
     table1_end_y = page1_table.geometry.polygon[2].y
-    if any(1 - header_footer_height > line.geometry.polygon[2].y > table1_end_y for line in page1.lines):
+    if t_doc.lines_between(page1, table1_end_y, 1 - header_footer_height, edge="bottom"):
         return False
     # Validate table 2 with second page header
-    table2_start_y = page2_table.geometry.boundingBox.top
-    if any(header_footer_height < line.geometry.boundingBox.top < table2_start_y for line in page2.lines):
+    table2_start_y = page2_table.geometry.bounding_box.top
+    if t_doc.lines_between(page2, header_footer_height, table2_start_y, edge="top"):
         return False
     return True
 
 
-def __compare_table_column_numbers(table_1, table_2):
+def __first_row_cells(t_doc: TDocument, table: TBlock) -> List[TBlock]:
+    """
+    cells with RowIndex 1 of the table, by column
+    """
+    cells = [
+        cell for cell in t_doc.get_blocks_for_relationships(table.get_relationships_for_type()) if cell.row_index == 1
+    ]
+    return sorted(cells, key=lambda cell: cell.column_index)
+
+
+def __cell_text(t_doc: TDocument, cell: TBlock) -> str:
+    """
+    text of the words and selection elements of the cell, like trp.Cell.text
+    """
+    text = ""
+    for child in t_doc.get_blocks_for_relationships(cell.get_relationships_for_type()):
+        if child.block_type == TextractBlockTypes.WORD.name:
+            text = text + child.text + ' '
+        elif child.block_type == TextractBlockTypes.SELECTION_ELEMENT.name:
+            text = text + child.selection_status + ', '
+    return text.strip()
+
+
+def __compare_table_column_numbers(t_doc: TDocument, table_1: TBlock, table_2: TBlock):
     """
     Step 2_1: Comparing number of columns on each table
     """
-    table1_col_num = len(table_1.rows[0].cells)
-    table2_col_num = len(table_2.rows[0].cells)
+    table1_col_num = len(__first_row_cells(t_doc, table_1))
+    table2_col_num = len(__first_row_cells(t_doc, table_2))
     if table1_col_num == table2_col_num:
         return True
     else:
         return False
 
 
-def __compare_table_headers(table_1, table_2):
+def __compare_table_headers(t_doc: TDocument, table_1: TBlock, table_2: TBlock):
     """
     Step 2_2: Comparing table header (first row) text on each table
     """
-    headers_1 = [cell.text.strip() if cell.text else "" for cell in table_1.rows[0].cells]
-    headers_2 = [cell.text.strip() if cell.text else "" for cell in table_2.rows[0].cells]
+    headers_1 = [__cell_text(t_doc, cell) for cell in __first_row_cells(t_doc, table_1)]
+    headers_2 = [__cell_text(t_doc, cell) for cell in __first_row_cells(t_doc, table_2)]
     return headers_1 == headers_2
 
 
@@ -67,40 +90,50 @@ def __calculate_percentage_difference(measure_1, measure_2):
         return 0
 
 
-def __compare_table_dimensions(table_1, table_2, accuracy_percentage):
+def __compare_table_dimensions(table_1: TBlock, table_2: TBlock, accuracy_percentage):
     """
     Step 3: Validate table bounding boxes to check left and right margin positions
     """
-    width_difference = __calculate_percentage_difference(table_1.geometry.boundingBox.width,
-                                                         table_2.geometry.boundingBox.width)
-    left_difference = __calculate_percentage_difference(table_1.geometry.boundingBox.left,
-                                                        table_2.geometry.boundingBox.left)
+    width_difference = __calculate_percentage_difference(table_1.geometry.bounding_box.width,
+                                                         table_2.geometry.bounding_box.width)
+    left_difference = __calculate_percentage_difference(table_1.geometry.bounding_box.left,
+                                                        table_2.geometry.bounding_box.left)
     if width_difference < (100 - float(accuracy_percentage)) and left_difference < (100 - float(accuracy_percentage)):
         return True
     return False
 
 
+def __tables_by_top(t_doc: TDocument, page: TBlock) -> List[TBlock]:
+    """
+    tables of the page top to bottom (same key as order_blocks_by_geo)
+    """
+    return sorted(t_doc.tables(page=page),
+                  key=lambda b: b.geometry.bounding_box.top if b.geometry and b.geometry.bounding_box else 1)
+
+
 def ExecuteTableValidations(t_doc: t2.TDocument, header_footer_type: HeaderFooterType, accuracy_percentage: float):
     """
     Invoke validations for first and last tables on all pages recursively
     """
     table_ids_to_merge = {}
     table_ids_merge_list = []
-    from trp.t_pipeline import order_blocks_by_geo
-    ordered_doc = order_blocks_by_geo(t_doc)
-    trp_doc = trp.Document(TDocumentSchema().dump(ordered_doc))
+    pages = t_doc.pages
 
-    for ix_page, current_page in enumerate(trp_doc.pages[:-1]):
-        next_page = trp_doc.pages[ix_page + 1]
-        if not (current_page.tables and next_page.tables):  # Note in Python, bool([]) = False
+    for ix_page, current_page in enumerate(pages[:-1]):
+        next_page = pages[ix_page + 1]
+        current_page_tables = __tables_by_top(t_doc, current_page)
+        if not current_page_tables:
+            continue
+        next_page_tables = __tables_by_top(t_doc, next_page)
+        if not next_page_tables:
             continue
-        current_page_table = current_page.tables[len(current_page.tables) - 1]
-        next_page_table = next_page.tables[0]
-        result_1 = __validate_objects_between_tables(current_page, current_page_table, next_page, next_page_table,
-                                                     header_footer_type)
+        current_page_table = current_page_tables[len(current_page_tables) - 1]
+        next_page_table = next_page_tables[0]
+        result_1 = __validate_objects_between_tables(t_doc, current_page, current_page_table, next_page,
+                                                     next_page_table, header_footer_type)
         if (result_1):
-            result_2_1 = __compare_table_column_numbers(current_page_table, next_page_table)
-            result_2_2 = __compare_table_headers(current_page_table, next_page_table)
+            result_2_1 = __compare_table_column_numbers(t_doc, current_page_table, next_page_table)
+            result_2_2 = __compare_table_headers(t_doc, current_page_table, next_page_table)
             if (result_2_1 or result_2_2):
                 result3 = __compare_table_dimensions(current_page_table, next_page_table, accuracy_percentage)
                 if (result3):
@@ -1,7 +1,6 @@
 from __future__ import annotations
-from functools import lru_cache
 import typing
-from typing import List, Set, Dict, Optional, Iterator
+from typing import List, Set, Dict, Optional, Iterator, Tuple
 from dataclasses import dataclass, field
 import marshmallow as m
 from marshmallow import post_load
@@ -14,11 +13,43 @@ from uuid import uuid4, UUID
 import math
 import statistics
 from dataclasses import dataclass, field
+import json
 import logging
+from collections import deque
+from contextlib import contextmanager
+from bisect import bisect_left, bisect_right
 
 logger = logging.getLogger(__name__)
 
 
+def _optional_int(value) -> Optional[int]:
+    return None if value is None else int(value)
+
+
+def _optional_float(value) -> Optional[float]:
+    return None if value is None else float(value)
+
+
+def _optional_str(value) -> Optional[str]:
+    return None if value is None else str(value)
+
+
+def _without_none(data: dict) -> dict:
+    """same as BaseSchema.remove_skip_values: null values are not written to the Textract JSON"""
+    return {key: value for key, value in data.items() if value is not None}
+
+
+_RIGHT_ANGLE_COS_SIN = [(1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)]
+
+
+def cos_sin_for_degrees(degrees: float) -> Tuple[float, float]:
+    """cos and sin of the angle in degrees, exact for multiples of 90 degrees"""
+    if degrees % 90 == 0:
+        return _RIGHT_ANGLE_COS_SIN[int(degrees % 360) // 90]
+    angle = math.radians(degrees)
+    return math.cos(angle), math.sin(angle)
+
+
 class BaseSchema(m.Schema):
     """
     skip null values when generating JSON
@@ -76,6 +107,13 @@ class TPoint():
         self.x = x
         self.y = y
 
+    @classmethod
+    def from_dict(cls, point: dict) -> TPoint:
+        return cls(x=float(point["X"]), y=float(point["Y"]))
+
+    def to_dict(self) -> dict:
+        return _without_none({"X": _optional_float(self.x), "Y": _optional_float(self.y)})
+
     def scale(self, doc_width, doc_height):
         self.x: float = self.x * doc_width
         self.y: float = self.y * doc_height
@@ -91,7 +129,6 @@ class TPoint():
         '''
         return [self.x, self.y]
 
-    # TODO: add optimization for rotation of 90, 270, 180, -90, -180, -270 degrees
     def rotate(self,
                origin_x: float = 0.5,
                origin_y: float = 0.5,
@@ -101,23 +138,26 @@ class TPoint():
         rotating this point around an origin point
         force_limits enforces max 1 and min 0 values for the x and y coordinates (similar to min/max for Textract Schema Geometry)
         """
-        angle = math.radians(degrees)
-        ox = origin_x
-        oy = origin_y
-        px = self.x
-        py = self.y
-        cos_result = math.cos(angle)
-        sin_result = math.sin(angle)
-        new_x = ox + cos_result * (px - ox) - sin_result * (py - oy)
-        new_y = oy + sin_result * (px - ox) + cos_result * (py - oy)
-        if force_limits:
-            new_x = max(min(new_x, 1), 0)
-            new_y = max(min(new_y, 1), 0)
-        self.x = new_x
-        self.y = new_y
+        cos_result, sin_result = cos_sin_for_degrees(degrees)
+        return self._rotate(origin_x, origin_y, cos_result, sin_result, force_limits=force_limits)
+
+    def _rotate(self, origin_x: float, origin_y: float, cos_result: float, sin_result: float,
+                force_limits: bool = True) -> TPoint:
+        """rotate with the cos and sin of the angle already computed (see cos_sin_for_degrees)"""
+        self.x, self.y = _rotate_xy(self.x, self.y, origin_x, origin_y, cos_result, sin_result, force_limits)
         return self
 
 
+def _rotate_xy(x: float, y: float, origin_x: float, origin_y: float, cos_result: float, sin_result: float,
+               force_limits: bool) -> Tuple[float, float]:
+    new_x = origin_x + cos_result * (x - origin_x) - sin_result * (y - origin_y)
+    new_y = origin_y + sin_result * (x - origin_x) + cos_result * (y - origin_y)
+    if force_limits:
+        new_x = max(min(new_x, 1), 0)
+        new_y = max(min(new_y, 1), 0)
+    return new_x, new_y
+
+
 @dataclass(eq=True, repr=True, order=True, unsafe_hash=True)
 class TBoundingBox():
     width: float
@@ -131,6 +171,21 @@ class TBoundingBox():
         self.left = left
         self.top = top
 
+    @classmethod
+    def from_dict(cls, bounding_box: dict) -> TBoundingBox:
+        return cls(width=float(bounding_box["Width"]),
+                   height=float(bounding_box["Height"]),
+                   left=float(bounding_box["Left"]),
+                   top=float(bounding_box["Top"]))
+
+    def to_dict(self) -> dict:
+        return _without_none({
+            "Width": _optional_float(self.width),
+            "Height": _optional_float(self.height),
+            "Left": _optional_float(self.left),
+            "Top": _optional_float(self.top)
+        })
+
     def scale(self, doc_width, doc_height):
         self.top: float = self.top * doc_height
         self.height: float = self.height * doc_height
@@ -213,20 +268,23 @@ class TBoundingBox():
         rotate bounding box
         a bounding box sides are always parallel to x and y axis
         """
-        points = []
-        points.append(TPoint(x=self.left, y=self.top).rotate(origin_x=origin.x, origin_y=origin.y, degrees=degrees))
-        points.append(
-            TPoint(x=self.left + self.width, y=self.top).rotate(origin_x=origin.x, origin_y=origin.y, degrees=degrees))
-        points.append(
-            TPoint(x=self.left, y=self.top + self.height).rotate(origin_x=origin.x, origin_y=origin.y, degrees=degrees))
-        points.append(
-            TPoint(x=self.left + self.width, y=self.top + self.height).rotate(origin_x=origin.x,
-                                                                              origin_y=origin.y,
-                                                                              degrees=degrees))
-        xmin = min([p.x for p in points])
-        ymin = min([p.y for p in points])
-        xmax = max([p.x for p in points])
-        ymax = max([p.y for p in points])
+        cos_result, sin_result = cos_sin_for_degrees(degrees)
+        return self._rotate(origin.x, origin.y, cos_result, sin_result)
+
+    def _rotate(self, origin_x: float, origin_y: float, cos_result: float, sin_result: float) -> TBoundingBox:
+        """rotate with the cos and sin of the angle already computed (see cos_sin_for_degrees)"""
+        right = self.left + self.width
+        bottom = self.top + self.height
+        points = [
+            _rotate_xy(self.left, self.top, origin_x, origin_y, cos_result, sin_result, True),
+            _rotate_xy(right, self.top, origin_x, origin_y, cos_result, sin_result, True),
+            _rotate_xy(self.left, bottom, origin_x, origin_y, cos_result, sin_result, True),
+            _rotate_xy(right, bottom, origin_x, origin_y, cos_result, sin_result, True)
+        ]
+        xmin = min([x for x, _ in points])
+        ymin = min([y for _, y in points])
+        xmax = max([x for x, _ in points])
+        ymax = max([y for _, y in points])
 
         new_width = xmax - xmin
         new_height = ymax - ymin
@@ -264,13 +322,34 @@ class TGeometry():
     bounding_box: TBoundingBox
     polygon: List[TPoint]
 
+    @classmethod
+    def from_dict(cls, geometry: dict) -> TGeometry:
+        bounding_box = geometry.get("BoundingBox")
+        polygon = geometry.get("Polygon")
+        return cls(bounding_box=TBoundingBox.from_dict(bounding_box) if bounding_box is not None else None,
+                   polygon=[TPoint(x=float(p["X"]), y=float(p["Y"])) for p in polygon] if polygon is not None else None)
+
+    def to_dict(self) -> dict:
+        return _without_none({
+            "BoundingBox": self.bounding_box.to_dict() if self.bounding_box is not None else None,
+            "Polygon": [p.to_dict() for p in self.polygon] if self.polygon is not None else None
+        })
+
     def ratio(self, doc_width=None, doc_height=None):
         self.bounding_box.ratio(doc_width=doc_width, doc_height=doc_height)
         [x.ratio(doc_width=doc_width, doc_height=doc_height) for x in self.polygon]
 
     def rotate(self, origin: TPoint = TPoint(0, 0), degrees: float = 180.0):
-        self.bounding_box.rotate(origin=origin, degrees=degrees)
-        [p.rotate(origin_x=origin.x, origin_y=origin.y) for p in self.polygon]
+        cos_result, sin_result = cos_sin_for_degrees(degrees)
+        self._rotate(origin.x, origin.y, cos_result, sin_result)
+
+    def _rotate(self, origin_x: float, origin_y: float, cos_result: float, sin_result: float):
+        """rotate with the cos and sin of the angle already computed (see cos_sin_for_degrees)"""
+        if self.bounding_box:
+            self.bounding_box._rotate(origin_x, origin_y, cos_result, sin_result)
+        if self.polygon:
+            for p in self.polygon:
+                p._rotate(origin_x, origin_y, cos_result, sin_result)
 
     def scale(self, doc_width=None, doc_height=None):
         self.bounding_box.scale(doc_width=doc_width, doc_height=doc_height)
@@ -291,6 +370,13 @@ class TQuery:
     text: str = field(default=None)    # type: ignore
     alias: str = field(default=None)    # type: ignore
 
+    @classmethod
+    def from_dict(cls, query: dict) -> TQuery:
+        return cls(text=query.get("Text"), alias=query.get("Alias"))
+
+    def to_dict(self) -> dict:
+        return _without_none({"Text": _optional_str(self.text), "Alias": _optional_str(self.alias)})
+
 
 class TQuerySchema(BaseSchema):
     text = m.fields.String(data_key="Text", required=False)
@@ -301,11 +387,109 @@ class TQuerySchema(BaseSchema):
         return TQuery(**data)
 
 
+class TIdList(list):
+    '''
+    List of block ids with O(1) membership tests (`id in ids`), used for TRelationship.ids.
+    Keeps the order and duplicates of a list and serializes as a plain list.
+    '''
+
+    def __init__(self, ids: typing.Iterable[str] = ()):
+        super().__init__(ids)
+        self._rebuild_counts()
+
+    def _rebuild_counts(self):
+        self._counts: Dict[str, int] = dict()
+        for id in self:
+            self._counts[id] = self._counts.get(id, 0) + 1
+
+    def _added(self, id: str):
+        self._counts[id] = self._counts.get(id, 0) + 1
+
+    def _removed(self, id: str):
+        count = self._counts[id] - 1
+        if count:
+            self._counts[id] = count
+        else:
+            del self._counts[id]
+
+    def __contains__(self, id) -> bool:
+        try:
+            return id in self._counts
+        except TypeError:
+            return super().__contains__(id)
+
+    def __reduce_ex__(self, protocol):
+        return (self.__class__, (list(self), ))
+
+    def copy(self) -> TIdList:
+        return self.__class__(self)
+
+    def append(self, id: str):
+        super().append(id)
+        self._added(id)
+
+    def extend(self, ids: typing.Iterable[str]):
+        # one by one, so a generator checking `x not in ids` sees the ids added before
+        for id in ids:
+            self.append(id)
+
+    def __iadd__(self, ids: typing.Iterable[str]):
+        self.extend(ids)
+        return self
+
+    def insert(self, index, id: str):
+        super().insert(index, id)
+        self._added(id)
+
+    def remove(self, id: str):
+        super().remove(id)
+        self._removed(id)
+
+    def pop(self, index=-1) -> str:
+        id = super().pop(index)
+        self._removed(id)
+        return id
+
+    def clear(self):
+        super().clear()
+        self._counts.clear()
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self._rebuild_counts()
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._rebuild_counts()
+
+    def __imul__(self, n: int):
+        super().__imul__(n)
+        self._rebuild_counts()
+        return self
+
+
 @dataclass(eq=True, init=True, repr=True)
 class TRelationship():
     type: str = field(default=None)    #type: ignore
     ids: List[str] = field(default=None)    #type: ignore
 
+    def __setattr__(self, name, value):
+        # keep ids a TIdList, also when a plain list is assigned
+        if name == "ids" and value is not None and not isinstance(value, TIdList):
+            value = TIdList(value)
+        super().__setattr__(name, value)
+
+    @classmethod
+    def from_dict(cls, relationship: dict) -> TRelationship:
+        ids = relationship.get("Ids")
+        return cls(type=relationship.get("Type"), ids=TIdList(ids) if ids is not None else None)
+
+    def to_dict(self) -> dict:
+        return _without_none({
+            "Type": _optional_str(self.type),
+            "Ids": [str(x) for x in self.ids] if self.ids is not None else None
+        })
+
 
 class TRelationshipSchema(BaseSchema):
     type = m.fields.String(data_key="Type", required=False, allow_none=False)
@@ -347,6 +531,59 @@ class TBlock():
     def __hash__(self) -> int:
         return hash(self.id)
 
+    @classmethod
+    def from_dict(cls, block: dict) -> TBlock:
+        """
+        Build a TBlock from a Textract Block dict without going through TBlockSchema.
+        Produces the same object as TBlockSchema().load(block), but skips the marshmallow validation.
+        """
+        geometry = block.get("Geometry")
+        relationships = block.get("Relationships")
+        entity_types = block.get("EntityTypes")
+        custom = block.get("Custom")
+        query = block.get("Query")
+        return cls(geometry=TGeometry.from_dict(geometry) if geometry is not None else None,
+                   id=block.get("Id"),
+                   block_type=block.get("BlockType", ""),
+                   relationships=[TRelationship.from_dict(r) for r in relationships]
+                   if relationships is not None else None,
+                   confidence=_optional_float(block.get("Confidence")),
+                   text=block.get("Text"),
+                   column_index=_optional_int(block.get("ColumnIndex")),
+                   column_span=_optional_int(block.get("ColumnSpan")),
+                   entity_types=list(entity_types) if entity_types is not None else None,
+                   page=_optional_int(block.get("Page")),
+                   row_index=_optional_int(block.get("RowIndex")),
+                   row_span=_optional_int(block.get("RowSpan")),
+                   selection_status=block.get("SelectionStatus"),
+                   text_type=block.get("TextType"),
+                   custom=dict(custom) if custom is not None else None,
+                   query=TQuery.from_dict(query) if query is not None else None)
+
+    def to_dict(self) -> dict:
+        """
+        Serialize to the Textract Block dict without going through TBlockSchema.
+        Same output as TBlockSchema().dump(self), None values are left out.
+        """
+        return _without_none({
+            "BlockType": _optional_str(self.block_type),
+            "Geometry": self.geometry.to_dict() if self.geometry is not None else None,
+            "Id": _optional_str(self.id),
+            "Relationships": [r.to_dict() for r in self.relationships] if self.relationships is not None else None,
+            "Confidence": _optional_float(self.confidence),
+            "Text": _optional_str(self.text),
+            "ColumnIndex": _optional_int(self.column_index),
+            "ColumnSpan": _optional_int(self.column_span),
+            "EntityTypes": [str(x) for x in self.entity_types] if self.entity_types is not None else None,
+            "Page": _optional_int(self.page),
+            "RowIndex": _optional_int(self.row_index),
+            "RowSpan": _optional_int(self.row_span),
+            "SelectionStatus": _optional_str(self.selection_status),
+            "TextType": _optional_str(self.text_type),
+            "Custom": dict(self.custom) if self.custom is not None else None,
+            "Query": self.query.to_dict() if self.query is not None else None
+        })
+
     def get_relationships_for_type(self, relationship_type="CHILD") -> Optional[TRelationship]:
         """assuming only one relationship type entry in the list"""
         if self.relationships:
@@ -360,7 +597,7 @@ class TBlock():
         relationship = self.get_relationships_for_type(relationship_type=relationships_type)
         if relationship:
             if not relationship.ids:
-                relationship.ids = list()
+                relationship.ids = TIdList()
                 relationship.ids.extend(ids)
             else:
                 relationship.ids.extend(x for x in ids if x not in relationship.ids)
@@ -401,6 +638,13 @@ class TBlockSchema(BaseSchema):
 class TDocumentMetadata():
     pages: int = field(default=None)    #type: ignore
 
+    @classmethod
+    def from_dict(cls, document_metadata: dict) -> TDocumentMetadata:
+        return cls(pages=_optional_int(document_metadata.get("Pages")))
+
+    def to_dict(self) -> dict:
+        return _without_none({"Pages": _optional_int(self.pages)})
+
 
 class TDocumentMetadataSchema(BaseSchema):
     pages = m.fields.Int(data_key="Pages", required=False)
@@ -415,6 +659,17 @@ class TWarnings():
     error_code: str = field(default=None)    #type: ignore
     pages: List[int] = field(default=None)    #type: ignore
 
+    @classmethod
+    def from_dict(cls, warnings: dict) -> TWarnings:
+        pages = warnings.get("Pages")
+        return cls(error_code=warnings.get("ErrorCode"), pages=[int(x) for x in pages] if pages is not None else None)
+
+    def to_dict(self) -> dict:
+        return _without_none({
+            "Pages": [int(x) for x in self.pages] if self.pages is not None else None,
+            "ErrorCode": _optional_str(self.error_code)
+        })
+
 
 class TWarningsSchema(BaseSchema):
     pages = m.fields.List(m.fields.Int, data_key="Pages", required=False, allow_none=False)
@@ -433,6 +688,23 @@ class THttpHeaders():
     connection: str = field(default=None)    #type: ignore
     date: str = field(default=None)    #type: ignore
 
+    @classmethod
+    def from_dict(cls, http_headers: dict) -> THttpHeaders:
+        return cls(x_amzn_request_id=http_headers.get("x-amzn-requestid"),
+                   content_type=http_headers.get("content-type"),
+                   content_length=_optional_int(http_headers.get("content-length")),
+                   connection=http_headers.get("connection"),
+                   date=http_headers.get("date"))
+
+    def to_dict(self) -> dict:
+        return _without_none({
+            "date": _optional_str(self.date),
+            "x-amzn-requestid": _optional_str(self.x_amzn_request_id),
+            "content-type": _optional_str(self.content_type),
+            "content-length": _optional_int(self.content_length),
+            "connection": _optional_str(self.connection)
+        })
+
 
 @dataclass(eq=True, init=True, repr=True)
 class TResponseMetadata():
@@ -441,11 +713,28 @@ class TResponseMetadata():
     retry_attempts: int = field(default=None)    #type: ignore
     http_headers: THttpHeaders = field(default=None)    #type: ignore
 
+    @classmethod
+    def from_dict(cls, response_metadata: dict) -> TResponseMetadata:
+        http_headers = response_metadata.get("HTTPHeaders")
+        return cls(request_id=response_metadata.get("RequestId"),
+                   http_status_code=_optional_int(response_metadata.get("HTTPStatusCode")),
+                   retry_attempts=_optional_int(response_metadata.get("RetryAttempts")),
+                   http_headers=THttpHeaders.from_dict(http_headers) if http_headers is not None else None)
+
+    def to_dict(self) -> dict:
+        return _without_none({
+            "RequestId": _optional_str(self.request_id),
+            "HTTPStatusCode": _optional_int(self.http_status_code),
+            "RetryAttempts": _optional_int(self.retry_attempts),
+            "HTTPHeaders": self.http_headers.to_dict() if self.http_headers is not None else None
+        })
+
 
 @dataclass(eq=True, init=True, repr=True)
 class TDocument():
     document_metadata: TDocumentMetadata = field(default=None)    #type: ignore
-    # if blocks are changed, call __post_init__() to update the index
+    # if blocks are changed, call __post_init__() to update the index (this also clears the reading order
+    # recorded with set_reading_order, as its indexes into blocks are no longer valid)
     blocks: List[TBlock] = field(default=None)    #type: ignore
     analyze_document_model_version: str = field(default=None)    #type: ignore
     detect_document_text_model_version: str = field(default=None)    #type: ignore
@@ -456,6 +745,11 @@ class TDocument():
     custom: dict = field(default=None)    #type: ignore
     next_token: str = field(default=None)    #type: ignore
     id: UUID = field(default_factory=uuid4)
+    # nesting depth of batch() and the block ids to delete when the outermost batch ends
+    _batch_depth = 0
+    _pending_deletes = None
+    # page id -> indexes into self.blocks of the page's blocks in reading order, see set_reading_order
+    _reading_order = None
 
     def __post_init__(self):    #this is a dataclass method
         '''
@@ -472,6 +766,16 @@ class TDocument():
           specifier.
         * Method __post_init__ called by @dataclass after  __init__ call
         '''
+        self._build_block_id_maps()
+        self._reset_relationship_indexes()
+        self._reset_page_indexes()
+        # child id -> [(parent id, relationship type)], built on first use, then kept up to date
+        # by add_block and delete_blocks
+        self._parents: Optional[Dict[str, List[Tuple[str, str]]]] = None
+        # indexes into self.blocks, not valid after self.blocks changed, see set_reading_order
+        self._reading_order: Optional[Dict[str, List[int]]] = None
+
+    def _build_block_id_maps(self):
         self._block_id_maps: Dict[str, typing.Dict[str, int]] = dict()
         self._block_id_maps['ALL'] = dict()
         # Initialise maps for all expected block types:
@@ -488,9 +792,84 @@ class TDocument():
 
                 self._block_id_maps['ALL'][blk.id] = blk_i
 
+    def _reset_relationship_indexes(self):
+        # descendants per block id, filled on demand by relationships_recursive
+        self._descendants: Dict[str, List[TBlock]] = dict()
+        # descendants per block id and block type, filled on demand by get_blocks_by_type
+        self._descendants_by_type: Dict[str, Dict[str, List[TBlock]]] = dict()
+        # columnar geometry of all blocks (trp.t_geometry.TGeometryStore), built on demand by geometry_store
+        self._geometry_store = None
+        self._reset_geometry_indexes()
+
+    def _reset_geometry_indexes(self):
+        # (page id, edge) -> (sorted y values, LINE blocks in the same order), filled on demand by lines_between
+        self._lines_by_y: Dict[Tuple[str, str], Tuple[List[float], List[TBlock]]] = dict()
+        # TGeometryStore.changes the indexes were built with, they are dropped when the store was changed since
+        self._geometry_changes = self._geometry_store.changes if self._geometry_store is not None else 0
+
+    def _reset_page_indexes(self):
+        # ordered PAGE blocks and the lookup by page number, built on first use
+        self._pages: Optional[List[TBlock]] = None
+        self._pages_by_number: Optional[Dict[int, TBlock]] = None
+
     def __hash__(self):
         return int(self.id)
 
+    @classmethod
+    def from_dict(cls, document: dict) -> TDocument:
+        '''
+        Build a TDocument from a Textract JSON response dict without marshmallow.
+
+        Returns the same object structure as TDocumentSchema().load(document), but skips the
+        schema validation, which makes it several times faster on large responses.
+        Unknown keys are ignored (like TDocumentSchema, which uses unknown=EXCLUDE).
+        '''
+        document_metadata = document.get("DocumentMetadata")
+        blocks = document.get("Blocks")
+        warnings = document.get("Warnings")
+        response_metadata = document.get("ResponseMetadata")
+        custom = document.get("Custom")
+        return cls(document_metadata=TDocumentMetadata.from_dict(document_metadata)
+                   if document_metadata is not None else None,
+                   blocks=[TBlock.from_dict(b) for b in blocks] if blocks is not None else None,
+                   analyze_document_model_version=document.get("AnalyzeDocumentModelVersion"),
+                   detect_document_text_model_version=document.get("DetectDocumentTextModelVersion"),
+                   status_message=document.get("StatusMessage"),
+                   warnings=TWarnings.from_dict(warnings) if warnings is not None else None,
+                   job_status=document.get("JobStatus"),
+                   response_metadata=TResponseMetadata.from_dict(response_metadata)
+                   if response_metadata is not None else None,
+                   custom=dict(custom) if custom is not None else None,
+                   next_token=document.get("NextToken"))
+
+    def to_dict(self) -> dict:
+        '''
+        Serialize to the Textract JSON response dict without marshmallow.
+        Same output as TDocumentSchema().dump(self): None values are left out.
+        '''
+        return _without_none({
+            "DocumentMetadata": self.document_metadata.to_dict() if self.document_metadata is not None else None,
+            "Blocks": [b.to_dict() for b in self.blocks_in_reading_order()] if self.blocks is not None else None,
+            "AnalyzeDocumentModelVersion": _optional_str(self.analyze_document_model_version),
+            "DetectDocumentTextModelVersion": _optional_str(self.detect_document_text_model_version),
+            "StatusMessage": _optional_str(self.status_message),
+            "Warnings": self.warnings.to_dict() if self.warnings is not None else None,
+            "JobStatus": _optional_str(self.job_status),
+            "NextToken": _optional_str(self.next_token),
+            "ResponseMetadata": self.response_metadata.to_dict() if self.response_metadata is not None else None,
+            "Custom": dict(self.custom) if self.custom is not None else None
+        })
+
+    def to_json(self, fp: typing.Optional[typing.TextIO] = None, **kwargs) -> Optional[str]:
+        '''
+        Serialize to Textract JSON. Returns the JSON string, or if a file object is given as fp,
+        streams the JSON to it and returns None. kwargs are passed to json.dump(s).
+        '''
+        if fp is not None:
+            json.dump(self.to_dict(), fp, **kwargs)
+            return None
+        return json.dumps(self.to_dict(), **kwargs)
+
     def block_id_map(self, block_type: Optional[TextractBlockTypes] = None) -> Dict[str, int]:
         '''
         Return a hashmap  with the block ID as key and the block index in self.blocks 
@@ -528,11 +907,16 @@ class TDocument():
                 except KeyError:
                     self._block_id_maps[block.block_type] = dict()
                     self._block_id_maps[block.block_type][block.id] = len(self.blocks) - 1
+            if self._parents is not None:
+                TDocument._add_parent_entries(self._parents, block)
+            if block.block_type == TextractBlockTypes.PAGE.name:
+                self._reset_page_indexes()
         if not page:
-            page = self.pages[0]
+            page = self._page_list()[0]
         page.add_ids_to_relationships(ids=[block.id])
-        self.__post_init__()
-        self.relationships_recursive.cache_clear()
+        if self._parents is not None:
+            TDocument._add_parent_entry(self._parents, block.id, page.id, "CHILD")
+        self._reset_relationship_indexes()
 
     @staticmethod
     def create_geometry_from_blocks(values: List[TBlock]) -> Optional[TGeometry]:
@@ -588,10 +972,9 @@ class TDocument():
             if not value_block.id or not self.get_block_by_id(value_block.id):
                 raise ValueError("value blocks to add have to already exist. Use add_word_block for new ones.")
 
-        if values[0].page:
-            page_block = self.pages[values[0].page - 1]
-        else:
-            page_block = self.pages[0]
+        page_block = self.page_by_number(values[0].page) if values[0].page else None
+        if not page_block:
+            page_block = self._page_list()[0]
 
         value_block = TDocument.create_value_block(values=values)
         self.add_block(value_block, page=page_block)
@@ -618,13 +1001,50 @@ class TDocument():
             raise ValueError("need a page to rotate")
         if not degrees:
             raise ValueError("need degrees to rotate")
-        [b.rotate(origin=origin, degrees=float(degrees)) for b in self.relationships_recursive(block=page)]
-        self.relationships_recursive.cache_clear()
+        # the rotation is computed once for the page, exact for multiples of 90 degrees
+        cos_result, sin_result = cos_sin_for_degrees(float(degrees))
+        blocks = self._descendants_of(page)
+        if self._geometry_store is not None:
+            store = self._geometry_store
+            store.rotate_with(cos_result, sin_result, origin.x, origin.y, rows=store.rows_for(blocks))
+        else:
+            for b in blocks:
+                if b.geometry:
+                    b.geometry._rotate(origin.x, origin.y, cos_result, sin_result)
+        self._reset_geometry_indexes()
+
+    def scale(self, page: TBlock, doc_width: float, doc_height: float) -> None:
+        '''scale the geometry of the blocks of the page from ratios to the document size, see TGeometry.scale'''
+        if not page:
+            raise ValueError("need a page to scale")
+        blocks = self._descendants_of(page)
+        if self._geometry_store is not None:
+            store = self._geometry_store
+            store.scale(doc_width, doc_height, rows=store.rows_for(blocks))
+        else:
+            for b in blocks:
+                if b.geometry:
+                    b.geometry.scale(doc_width=doc_width, doc_height=doc_height)
+        self._reset_geometry_indexes()
+
+    def ratio(self, page: TBlock, doc_width: float, doc_height: float) -> None:
+        '''turn the geometry of the blocks of the page from the document size to ratios, see TGeometry.ratio'''
+        if not page:
+            raise ValueError("need a page to ratio")
+        blocks = self._descendants_of(page)
+        if self._geometry_store is not None:
+            store = self._geometry_store
+            store.ratio(doc_width, doc_height, rows=store.rows_for(blocks))
+        else:
+            for b in blocks:
+                if b.geometry:
+                    b.geometry.ratio(doc_width=doc_width, doc_height=doc_height)
+        self._reset_geometry_indexes()
 
     def find_block_by_id(self, id: str) -> Optional[TBlock]:
         '''Find a block by its ID. Returns None if not found'''
         idx = self.block_id_map().get(id, None)
-        if idx:
+        if idx is not None:
             return self.blocks[idx]
         return None
 
@@ -635,33 +1055,151 @@ class TDocument():
         else:
             raise ValueError(f"no block for id: {id}")
 
-    def __relationships_recursive(self, block: TBlock) -> Iterator[TBlock]:
-        import itertools
-        if block and block.relationships:
-            all_relations = list(itertools.chain(*[r.ids for r in block.relationships if r and r.ids]))
-            all_block = [self.get_block_by_id(id) for id in all_relations if id]
-            for b in all_block:
-                if b:
-                    yield b
-                    for child in self.__relationships_recursive(block=b):
-                        yield child
-
-    @lru_cache()
+    def _descendants_of(self, block: TBlock) -> List[TBlock]:
+        '''
+        All blocks reachable from block through its relationships, depth first in the order
+        of the relationship ids, each block once. Walks iteratively (no recursion limit on deep or
+        cyclic relationships) and keeps the result per block id until the document is re-indexed.
+        '''
+        descendants = self._descendants.get(block.id)
+        if descendants is not None:
+            return descendants
+        descendants = list()
+        seen: Set[str] = set()
+        stack: List[Iterator[str]] = [TDocument._relationship_ids(block)]
+        while stack:
+            for id in stack[-1]:
+                if not id or id in seen:
+                    continue
+                seen.add(id)
+                child = self.get_block_by_id(id)
+                descendants.append(child)
+                if child.relationships:
+                    stack.append(TDocument._relationship_ids(child))
+                    break
+            else:
+                stack.pop()
+        self._descendants[block.id] = descendants
+        return descendants
+
+    def _descendants_by_type_of(self, block: TBlock) -> Dict[str, List[TBlock]]:
+        '''
+        The descendants of block grouped by block type, in the order of _descendants_of.
+        Built with one pass over the descendants on first use and kept until the document is re-indexed.
+        '''
+        by_type = self._descendants_by_type.get(block.id)
+        if by_type is None:
+            by_type = dict()
+            for descendant in self._descendants_of(block):
+                by_type.setdefault(descendant.block_type, []).append(descendant)
+            self._descendants_by_type[block.id] = by_type
+        return by_type
+
+    @staticmethod
+    def _relationship_ids(block: TBlock) -> Iterator[str]:
+        if block.relationships:
+            for r in block.relationships:
+                if r and r.ids:
+                    yield from r.ids
+
     def relationships_recursive(self, block: TBlock) -> Set[TBlock]:
-        return set(self.__relationships_recursive(block=block))
+        '''
+        Return all blocks related to block, directly or through other blocks.
+        The result is cached on the document; call __post_init__() after changing blocks or
+        relationships directly (add_block and delete_blocks do this already).
+        '''
+        if not block:
+            return set()
+        return set(self._descendants_of(block))
+
+    def _page_list(self) -> List[TBlock]:
+        '''the cached, ordered PAGE blocks. Not a copy, do not change the list'''
+        if self._pages is None:
+            page_blocks = self.get_blocks_by_type(block_type_enum=TextractBlockTypes.PAGE)
+            # We'd like to return pages in explicitly-specified order where appropriate, but some
+            # (e.g. older) Textract API responses may not tag every PAGE block with a `Page` number,
+            # and `sorted()` will fail if we try to compare numbers vs `None`:
+            if all(block.page is not None for block in page_blocks):
+                page_blocks = sorted(page_blocks, key=lambda item: item.page)
+            self._pages = page_blocks
+        return self._pages
 
     @property
     def pages(self) -> List[TBlock]:
-        page_blocks = self.filter_blocks_by_type(
-            self.blocks,
-            textract_block_type=[TextractBlockTypes.PAGE],
-        )
-        # We'd like to return pages in explicitly-specified order where appropriate, but some
-        # (e.g. older) Textract API responses may not tag every PAGE block with a `Page` number,
-        # and `sorted()` will fail if we try to compare numbers vs `None`:
-        if all(block.page is not None for block in page_blocks):
-            page_blocks = sorted(page_blocks, key=lambda item: item.page)
-        return page_blocks
+        return list(self._page_list())
+
+    def page_by_number(self, page_number: int) -> Optional[TBlock]:
+        '''
+        Return the PAGE block with the given page number (starting at 1), or None.
+        Responses without page numbers on the PAGE blocks are numbered in block order.
+        '''
+        if self._pages_by_number is None:
+            page_blocks = self._page_list()
+            if all(block.page is not None for block in page_blocks):
+                self._pages_by_number = {block.page: block for block in page_blocks}
+            else:
+                self._pages_by_number = {idx: block for idx, block in enumerate(page_blocks, start=1)}
+        return self._pages_by_number.get(page_number)
+
+    @staticmethod
+    def _add_parent_entry(parents: Dict[str, List[Tuple[str, str]]], child_id: str, parent_id: str,
+                          relationship_type: str):
+        entries = parents.setdefault(child_id, [])
+        if (parent_id, relationship_type) not in entries:
+            entries.append((parent_id, relationship_type))
+
+    @staticmethod
+    def _add_parent_entries(parents: Dict[str, List[Tuple[str, str]]], block: TBlock):
+        if block.relationships:
+            for r in block.relationships:
+                if r and r.ids:
+                    for id in r.ids:
+                        TDocument._add_parent_entry(parents, id, block.id, r.type)
+
+    def _parent_index(self) -> Dict[str, List[Tuple[str, str]]]:
+        if self._parents is None:
+            parents: Dict[str, List[Tuple[str, str]]] = dict()
+            if self.blocks:
+                for block in self.blocks:
+                    TDocument._add_parent_entries(parents, block)
+            self._parents = parents
+        return self._parents
+
+    def parents(self, block: TBlock, relationship_type: Optional[str] = None) -> List[TBlock]:
+        '''
+        Return the blocks that have block in their relationships, e.g. the LINE and CELL of a WORD,
+        the TABLE of a CELL or the KEY of a VALUE (relationship_type="VALUE").
+        Without relationship_type all relationship types are considered.
+        '''
+        result: List[TBlock] = list()
+        for parent_id, parent_relationship_type in self._parent_index().get(block.id, []):
+            if relationship_type is None or parent_relationship_type == relationship_type:
+                parent = self.find_block_by_id(parent_id)
+                if parent:
+                    result.append(parent)
+        return result
+
+    def ancestors(self, block: TBlock) -> List[TBlock]:
+        '''Return all blocks block is related to upwards, nearest first, each block once'''
+        result: List[TBlock] = list()
+        seen: Set[str] = {block.id}
+        queue = deque([block])
+        while queue:
+            for parent in self.parents(queue.popleft()):
+                if parent.id not in seen:
+                    seen.add(parent.id)
+                    result.append(parent)
+                    queue.append(parent)
+        return result
+
+    def page_of(self, block: TBlock) -> Optional[TBlock]:
+        '''Return the PAGE block the block belongs to (the page itself for a PAGE block), or None'''
+        if block.block_type == TextractBlockTypes.PAGE.name:
+            return block
+        for ancestor in self.ancestors(block):
+            if ancestor.block_type == TextractBlockTypes.PAGE.name:
+                return ancestor
+        return None
 
     @staticmethod
     def filter_blocks_by_type(block_list: List[TBlock],
@@ -687,20 +1225,15 @@ class TDocument():
         if page:
             if not page.relationships:
                 return list()
-            block_list = list(self.relationships_recursive(page))
             if block_type_enum:
-                return self.filter_blocks_by_type(block_list=block_list, textract_block_type=[block_type_enum])
+                return list(self._descendants_by_type_of(page).get(block_type_enum.name, []))
             else:
-                return block_list
+                return list(self._descendants_of(page))
         else:
             if self.blocks:
-                block_list: List[TBlock] = list()
-                for b in self.blocks:
-                    if block_type_enum and b.block_type == block_type_enum.name:
-                        block_list.append(b)
-                    if not block_type_enum:
-                        block_list.append(b)
-                return block_list
+                if block_type_enum:
+                    return [self.blocks[i] for i in self._block_id_maps.get(block_type_enum.name, {}).values()]
+                return list(self.blocks)
             else:
                 return list()
 
@@ -779,45 +1312,232 @@ class TDocument():
             return blocks
         return list()
 
+    @contextmanager
+    def batch(self):
+        '''
+        Group many add_block/delete_blocks calls (and the methods using them, like add_key_values).
+        Deleted blocks are collected and removed in one pass over the blocks when the outermost
+        batch ends, until then they can still be found by id.
+
+        Usage
+        -----
+        with t_document.batch():
+            for key_name, values in new_keys:
+                t_document.add_key_values(key_name=key_name, values=values, page_block=page)
+            t_document.delete_blocks(obsolete_ids)
+        '''
+        if self._batch_depth == 0:
+            self._pending_deletes = list()
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                pending_deletes, self._pending_deletes = self._pending_deletes, None
+                if pending_deletes:
+                    self._delete_blocks(pending_deletes)
+
+    def geometry_store(self):
+        '''
+        Return the trp.t_geometry.TGeometryStore for the blocks of this document: their bounding boxes and
+        polygons as NumPy arrays, with the block geometries turned into views on them. Requires numpy.
+        Built on first use and again after blocks were added or deleted.
+        '''
+        if self._geometry_store is None:
+            from trp.t_geometry import TGeometryStore
+            self._geometry_store = TGeometryStore(self.blocks if self.blocks else [])
+        return self._geometry_store
+
+    def has_geometry_store(self) -> bool:
+        '''True if geometry_store() was built and is still valid, i.e. the block geometries are views on its arrays'''
+        return self._geometry_store is not None
+
+    def lines_between(self, page: TBlock, y0: float, y1: float, edge: str = "top") -> List[TBlock]:
+        '''
+        Return the LINE blocks of the page with their bounding box top (edge="top") or bottom (edge="bottom")
+        strictly between y0 and y1, top to bottom. The lines of a page are sorted once and then found by
+        binary search, e.g. for the text between two tables or in the header (lines_between(page, 0, 0.1)) or
+        footer (lines_between(page, 0.9, 1, edge="bottom")) area of a page.
+        The sorted lines are rebuilt after rotate, scale, ratio or a change through geometry_store(), after
+        changing block geometries directly call __post_init__().
+        '''
+        if edge not in ("top", "bottom"):
+            raise ValueError(f"edge has to be 'top' or 'bottom', got: {edge}")
+        if self._geometry_store is not None and self._geometry_store.changes != self._geometry_changes:
+            self._reset_geometry_indexes()
+        index = self._lines_by_y.get((page.id, edge))
+        if index is None:
+            lines = [
+                line for line in self.get_blocks_by_type(page=page, block_type_enum=TextractBlockTypes.LINE)
+                if line.geometry and line.geometry.bounding_box
+            ]
+            if edge == "top":
+                lines.sort(key=lambda line: line.geometry.bounding_box.top)
+                index = ([line.geometry.bounding_box.top for line in lines], lines)
+            else:
+                lines.sort(key=lambda line: line.geometry.bounding_box.bottom)
+                index = ([line.geometry.bounding_box.bottom for line in lines], lines)
+            self._lines_by_y[(page.id, edge)] = index
+        y_values, lines = index
+        return lines[bisect_right(y_values, y0):bisect_left(y_values, y1)]
+
+    def set_reading_order(self, page: TBlock, blocks: List[TBlock]):
+        '''
+        Record the reading order of the blocks of a page (without the page itself) as their indexes in
+        self.blocks. self.blocks and the id maps are not changed, the order is applied by
+        blocks_in_reading_order, to_dict/to_json and TDocumentSchema().dump.
+        add_block and delete_blocks keep the recorded order, __post_init__() clears it.
+        '''
+        block_id_map = self.block_id_map()
+        if self._reading_order is None:
+            self._reading_order = dict()
+        self._reading_order[page.id] = [block_id_map[b.id] for b in blocks]
+
+    def has_reading_order(self) -> bool:
+        return bool(self._reading_order)
+
+    def reading_order(self) -> List[int]:
+        '''
+        Indexes into self.blocks in reading order: each page followed by the blocks recorded with
+        set_reading_order and then by its other blocks (e.g. added later, or the page has no recorded order)
+        in self.blocks order. Blocks not on any page come last. Without a recorded order this is
+        range(len(self.blocks)).
+        Relationship ids without a block (e.g. of tables removed by merge_tables) are skipped.
+        '''
+        if not self.blocks:
+            return list()
+        if not self._reading_order:
+            return list(range(len(self.blocks)))
+        block_id_map = self.block_id_map()
+        order: List[int] = list()
+        seen: Set[int] = set()
+        for page in self._page_list():
+            page_index = block_id_map[page.id]
+            page_order = [page_index] + self._reading_order.get(page.id, [])
+            page_order.extend(sorted(self._reachable_indexes(page_index)))
+            for index in page_order:
+                if index not in seen:
+                    seen.add(index)
+                    order.append(index)
+        order.extend(index for index in range(len(self.blocks)) if index not in seen)
+        return order
+
+    def _reachable_indexes(self, index: int) -> Set[int]:
+        '''Indexes of the blocks reachable from self.blocks[index], ids without a block are skipped'''
+        block_id_map = self.block_id_map()
+        reachable: Set[int] = set()
+        stack = [index]
+        while stack:
+            for id in TDocument._relationship_ids(self.blocks[stack.pop()]):
+                child_index = block_id_map.get(id) if id else None
+                if child_index is not None and child_index not in reachable:
+                    reachable.add(child_index)
+                    stack.append(child_index)
+        reachable.discard(index)
+        return reachable
+
+    def blocks_in_reading_order(self) -> List[TBlock]:
+        '''self.blocks in the order recorded with set_reading_order, see reading_order'''
+        if not self._reading_order:
+            return list(self.blocks) if self.blocks else list()
+        return [self.blocks[index] for index in self.reading_order()]
+
     def delete_blocks(self, block_id: List[str]):
-        # delete from high index number to low index number to avoid deleting the wrong index after removing a lower valued one
-        indexes = [self.block_id_map()[id] for id in block_id]
-        indexes.sort(reverse=True)
-        for index in indexes:
-            del self.blocks[index]
-        self.__post_init__()
-        self.relationships_recursive.cache_clear()
+        if self._batch_depth:
+            for id in block_id:
+                if id not in self.block_id_map():
+                    raise KeyError(id)
+            self._pending_deletes.extend(block_id)    #type: ignore
+        else:
+            self._delete_blocks(block_id)
+
+    def _delete_blocks(self, block_id: List[str]):
+        indexes = {self.block_id_map()[id] for id in block_id}
+        deleted_blocks = [self.blocks[index] for index in indexes]
+        if self._reading_order:
+            # move the recorded indexes to the positions of the blocks after the delete
+            new_indexes: List[int] = list()
+            kept = 0
+            for index in range(len(self.blocks)):
+                if index in indexes:
+                    new_indexes.append(-1)
+                else:
+                    new_indexes.append(kept)
+                    kept += 1
+            deleted_ids = {b.id for b in deleted_blocks}
+            self._reading_order = {
+                page_id: [new_indexes[index] for index in page_order if new_indexes[index] >= 0]
+                for page_id, page_order in self._reading_order.items() if page_id not in deleted_ids
+            }
+        self.blocks[:] = [b for index, b in enumerate(self.blocks) if index not in indexes]
+        self._build_block_id_maps()
+        if self._parents is not None:
+            for deleted_block in deleted_blocks:
+                self._parents.pop(deleted_block.id, None)
+                for id in TDocument._relationship_ids(deleted_block):
+                    entries = self._parents.get(id)
+                    if entries:
+                        entries[:] = [entry for entry in entries if entry[0] != deleted_block.id]
+        self._reset_relationship_indexes()
+        if any(b.block_type == TextractBlockTypes.PAGE.name for b in deleted_blocks):
+            self._reset_page_indexes()
 
     def merge_tables(self, table_array_ids: List[List[str]]):
+        '''
+        Merge tables: for each list of table ids, the cells of the following tables are appended to the first
+        table with their row index continued, then the following TABLE blocks are deleted (all in one pass).
+        All lists are checked before the first table is changed, on a ValueError the document is unchanged.
+        '''
+        # tables already merged into another table count as deleted, like when they were deleted one by one
+        absorbed_table_ids: Set[str] = set()
         for table_ids in table_array_ids:
             if len(table_ids) < 2:
                 raise ValueError("no parent and child tables given")
+            if table_ids[0] in absorbed_table_ids:
+                raise ValueError(f"no block for id: {table_ids[0]}")
             parent_table = self.get_block_by_id(table_ids[0])
             if type(parent_table) is not TBlock:
                 raise ValueError("parent table is invalid")
-            table_ids.pop(0)
-            parent_relationships: TRelationship = TRelationship()
-            if parent_table.relationships:
-                for r in parent_table.relationships:
-                    if r.type == "CHILD":
-                        parent_relationships = r
+            parent_relationships = TDocument._table_child_relationship(parent_table)
+            if parent_relationships and parent_relationships.ids:
+                for table_id in table_ids[1:]:
+                    if table_id in absorbed_table_ids:
+                        raise ValueError(f"no block for id: {table_id}")
+                    self.get_block_by_id(table_id)
+                    absorbed_table_ids.add(table_id)
+        merged_table_ids: List[str] = list()
+        for table_ids in table_array_ids:
+            parent_table = self.get_block_by_id(table_ids.pop(0))
+            parent_relationships = TDocument._table_child_relationship(parent_table)
             for table_id in table_ids:
                 if parent_relationships and parent_relationships.ids:
-                    parent_last_row = None
-                    parent_last_row_block = self.get_block_by_id(parent_relationships.ids[-1])
-                    if parent_last_row_block:
-                        parent_last_row = parent_last_row_block.row_index
+                    parent_last_row = self.get_block_by_id(parent_relationships.ids[-1]).row_index
                     child_table = self.get_block_by_id(table_id)
-                    if child_table and child_table.relationships:
+                    if child_table.relationships and parent_last_row:
                         for r in child_table.relationships:
                             if r.type == "CHILD" and r.ids:
                                 for cell_id in r.ids:
                                     cell_block = self.get_block_by_id(cell_id)
-                                    if cell_block and cell_block.row_index and parent_last_row:
+                                    if cell_block.row_index:
                                         cell_block.row_index = parent_last_row + cell_block.row_index
-                                        if parent_relationships.ids and cell_id not in parent_relationships.ids:
+                                        if cell_id not in parent_relationships.ids:
                                             parent_relationships.ids.append(cell_id)
-                    self.delete_blocks([table_id])
+                                            if self._parents is not None:
+                                                TDocument._add_parent_entry(self._parents, cell_id, parent_table.id,
+                                                                            "CHILD")
+                    merged_table_ids.append(table_id)
+        self._reset_relationship_indexes()
+        self.delete_blocks(list(dict.fromkeys(merged_table_ids)))
+
+    @staticmethod
+    def _table_child_relationship(table: TBlock) -> TRelationship:
+        child_relationship: TRelationship = TRelationship()
+        if table.relationships:
+            for r in table.relationships:
+                if r.type == "CHILD":
+                    child_relationship = r
+        return child_relationship
 
     def link_tables(self, table_array_ids: List[List[str]]):
         for table_ids in table_array_ids:
@@ -835,7 +1555,6 @@ class TDocument():
                         table.custom['next_table'] = table_ids[i + 1]
                     else:
                         table.custom = {'next_table': table_ids[i + 1]}
-        self.relationships_recursive.cache_clear()
 
 
 class THttpHeadersSchema(BaseSchema):
@@ -898,3 +1617,18 @@ class TDocumentSchema(BaseSchema):
     @post_load
     def make_tdocument(self, data, **kwargs):
         return TDocument(**data)
+
+    @m.post_dump(pass_original=True)
+    def apply_reading_order(self, data, original, **kwargs):
+        if isinstance(original, TDocument) and original.has_reading_order() and "Blocks" in data:
+            data["Blocks"] = [data["Blocks"][index] for index in original.reading_order()]
+        return data
+
+
+def fast_load(document: dict) -> TDocument:
+    '''
+    Deserialize a Textract JSON response dict into a TDocument, bypassing marshmallow.
+    Shortcut for TDocument.from_dict(document).
+    '''
+    return TDocument.from_dict(document)
+